@@ -0,0 +1,80 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Sorted index over the image sizes of all fingerprints. For the responses of a trace, it returns the
+# fingerprints that can possibly reach a sequence of 'minSequence' images, so all other fingerprints
+# can be skipped without calling handleSingleQuery.
+
+import numpy as np
+
+
+class CandidateIndex(object):
+    def __init__(self, allImageLen):
+        sizes = []
+        owners = []
+        for v in range(0, len(allImageLen)):
+            for imlen in allImageLen[v]:
+                sizes.append(int(imlen))
+                owners.append(v)
+        order = np.argsort(np.array(sizes, dtype=np.int64), kind="stable")
+        self.sizes = np.array(sizes, dtype=np.int64)[order]
+        self.owners = np.array(owners, dtype=np.int64)[order]
+        self.numberFingerprints = len(allImageLen)
+        # The images in their original order as well, fingerprint v is images[imageOffsets[v]:imageOffsets[v + 1]].
+        self.images = np.array(sizes, dtype=np.int64)
+        self.imageOffsets = np.cumsum([0] + [len(images) for images in allImageLen]).tolist()
+
+    def getCandidates(self, responses, headerGuess, rangeHeaderGuess, minSequence, useImageOrder):
+        if (len(responses) == 0):
+            return []
+        respLen = np.asarray(responses, dtype=np.int64)
+
+        if (useImageOrder):
+            # An ordered sequence needs 'minSequence' different images with respI - headerGuess - imlenI < rangeHeaderGuess.
+            # The smallest response gives the widest window for all of them.
+            start = np.searchsorted(self.sizes, respLen.min() - headerGuess - rangeHeaderGuess, side="right")
+            imagesInRange = np.bincount(self.owners[start:], minlength=self.numberFingerprints)
+            return np.nonzero(imagesInRange >= minSequence)[0].tolist()
+
+        # An unordered sequence needs 'minSequence' consecutive responses that each have an image of the
+        # fingerprint with respI - headerGuess > imlenI and respI - headerGuess - imlenI < rangeHeaderGuess.
+        lowIndex = np.searchsorted(self.sizes, respLen - headerGuess - rangeHeaderGuess, side="right").tolist()
+        highIndex = np.searchsorted(self.sizes, respLen - headerGuess, side="left").tolist()
+        candidates = set()
+        streaks = {}
+        for j in range(0, len(respLen)):
+            newStreaks = {}
+            for v in set(self.owners[lowIndex[j]:highIndex[j]].tolist()):
+                newStreaks[v] = streaks.get(v, 0) + 1
+                if (newStreaks[v] >= minSequence):
+                    candidates.add(v)
+            streaks = newStreaks
+        return sorted(candidates)
@@ -4,9 +4,12 @@ import sys
 import json
 import struct
 import os
+import socket
 
 # Set root directory where we have to save "URLS.txt"
 rootDir = "/home/mariano/RFWIH_Package"
+# Each worker of ImprovedIUPTIS_COLLECT.py has its own directory, which is inherited through the browser.
+rootDir = os.environ.get("IUPTIS_CHANNEL_DIR", rootDir)
 
 
 def getMessage():
@@ -28,16 +31,58 @@ def sendMessage(messageContent):
     sys.stdout.buffer.flush()
 
 
-urlData = open(rootDir + "/URLS.txt", "w+")
-while True:
-    receivedMessage = getMessage()
-    if (receivedMessage == "*READY*\n"):
-        f = open(rootDir + "/ready_iuptis", "w+")
-        f.write("ready_iuptis")
-        f.close()
-        continue
-    urlData.write(receivedMessage)
+# ImprovedIUPTIS_COLLECT.py listens on this Unix socket, so it gets each message as soon as it arrives.
+# If it is not listening, it falls back to the files.
+eventSock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+try:
+    eventSock.connect(rootDir + "/iuptis.sock")
+except OSError:
+    eventSock.close()
+    eventSock = None
+
+
+def sendEvent(message):
+    global eventSock
+    if (eventSock is None):
+        return
+    try:
+        eventSock.sendall(message.encode('utf-8'))
+    except OSError:
+        eventSock.close()
+        eventSock = None
+
+
+# Records are written to "URLS.txt" in batches of BATCH_SIZE and only synced to disk when the add-on is ready
+# or when the browser closes. ImprovedIUPTIS_COLLECT.py gets them through the socket in the meantime.
+# Without the socket, it reads the file, so each record is written immediately (but still not synced).
+BATCH_SIZE = 64
+pendingRecords = []
+
+
+def writeRecords(isDurable):
+    urlData.writelines(pendingRecords)
+    del pendingRecords[:]
     urlData.flush()
-    os.fsync(urlData)
+    if (isDurable):
+        os.fsync(urlData.fileno())
+
 
-urlData.close()
+# Append mode: when the browser is reused, ImprovedIUPTIS_COLLECT.py truncates this file between two profiles.
+urlData = open(rootDir + "/URLS.txt", "a")
+try:
+    while True:
+        receivedMessage = getMessage()
+        if (receivedMessage == "*READY*\n"):
+            writeRecords(True)
+            f = open(rootDir + "/ready_iuptis", "w+")
+            f.write("ready_iuptis")
+            f.close()
+            sendEvent(receivedMessage)
+            continue
+        pendingRecords.append(receivedMessage)
+        sendEvent(receivedMessage)
+        if (eventSock is None or len(pendingRecords) >= BATCH_SIZE):
+            writeRecords(False)
+finally:
+    writeRecords(True)
+    urlData.close()
@@ -50,9 +50,21 @@ function notifyReady()
 }
 
 
+// A new webpage is visited (the browser can be reused for multiple profiles), so forget everything of the previous one.
+function resetState()
+{
+    allRequests = [];
+    allResponses = [];
+    totalResponses = 0;
+    console.log("IUPTIS: State is reset.");
+}
+
+
 // Save all GET requests.
 function logReqURL(requestDetails) {
 	  console.log("Request: " + requestDetails.url);
+	  if (requestDetails.type === "main_frame")
+	  	resetState();
 	  if (requestDetails.method === "GET")
 	  	allRequests.push([requestDetails.url,requestDetails.requestId,requestDetails.timeStamp]);
 }
@@ -0,0 +1,220 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Persistent store of the fingerprints (image sizes) of all profiles, keyed by the profile name of 'queriesPath'.
+# It is a SQLite database with a fingerprint per profile and iteration. Iterations with the same image sizes share
+# the same row of image sizes. A single profile can be added or refreshed (for instance after collecting it again)
+# without rebuilding the store. The sorted index over all image sizes (as used by LiveClassifier.py) is saved in the
+# store as well, and is only rebuilt the first time it is loaded after a change.
+# Usage: python FingerprintStore.py build <store> <dataset_directory> <queries_file> [<number_iterations>]
+#        python FingerprintStore.py update <store> <dataset_directory> <queries_file> <profile_index> [<number_iterations>]
+
+import sys
+import time
+import hashlib
+import sqlite3
+import numpy as np
+import TraceCache
+import TraceFormat
+
+
+# Maximum number of parameters in a single SQLite query.
+QUERY_CHUNK = 500
+
+
+class FingerprintStore(object):
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, sizes BLOB NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fingerprints (name TEXT NOT NULL, iteration INTEGER NOT NULL, "
+                        "hash TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (name, iteration))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS fingerprintsHash ON fingerprints (hash)")
+        # Number of changes of the fingerprints, and the sorted index of the last generation that was loaded.
+        self.db.execute("CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)")
+        self.db.execute("INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sortedIndex (id INTEGER PRIMARY KEY CHECK (id = 0), generation INTEGER NOT NULL, "
+                        "names BLOB NOT NULL, fingerprintNames BLOB NOT NULL, sizes BLOB NOT NULL, owners BLOB NOT NULL)")
+        self.db.commit()
+        self.staleHashes = set()
+
+    def close(self):
+        self.db.close()
+
+    # Add or replace the fingerprint of a profile. Call commit() to save it.
+    def setFingerprint(self, name, iteration, imageSizes):
+        sizes = np.array([int(s) for s in imageSizes], dtype="<i4").tobytes()
+        sizesHash = hashlib.sha1(sizes).hexdigest()
+        row = self.db.execute("SELECT hash FROM fingerprints WHERE name = ? AND iteration = ?", (name, iteration)).fetchone()
+        if (row is not None):
+            self.staleHashes.add(row[0])
+        self.db.execute("INSERT OR IGNORE INTO images (hash, sizes) VALUES (?, ?)", (sizesHash, sizes))
+        self.db.execute("INSERT OR REPLACE INTO fingerprints (name, iteration, hash, updated) VALUES (?, ?, ?, ?)",
+                        (name, iteration, sizesHash, time.time()))
+
+    def removeProfile(self, name):
+        for row in self.db.execute("SELECT hash FROM fingerprints WHERE name = ?", (name,)).fetchall():
+            self.staleHashes.add(row[0])
+        self.db.execute("DELETE FROM fingerprints WHERE name = ?", (name,))
+
+    # Save all changes and remove the image sizes that are no longer used by any fingerprint.
+    def commit(self):
+        for sizesHash in self.staleHashes:
+            if (self.db.execute("SELECT 1 FROM fingerprints WHERE hash = ? LIMIT 1", (sizesHash,)).fetchone() is None):
+                self.db.execute("DELETE FROM images WHERE hash = ?", (sizesHash,))
+        self.staleHashes = set()
+        if (self.db.in_transaction):
+            self.db.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+        self.db.commit()
+
+    def getFingerprint(self, name, iteration):
+        row = self.db.execute("SELECT i.sizes FROM fingerprints f JOIN images i ON f.hash = i.hash "
+                              "WHERE f.name = ? AND f.iteration = ?", (name, iteration)).fetchone()
+        if (row is None):
+            return []
+        return np.frombuffer(row[0], dtype="<i4").tolist()
+
+    # Fingerprints of the given profiles, as {name: {iteration: [size, ...]}}. Profiles that are not in the store are left out.
+    def loadProfiles(self, allNames):
+        allNames = sorted(set(allNames))
+        allFingerprints = {}
+        for c in range(0, len(allNames), QUERY_CHUNK):
+            chunk = allNames[c:c + QUERY_CHUNK]
+            rows = self.db.execute("SELECT f.name, f.iteration, i.sizes FROM fingerprints f JOIN images i ON f.hash = i.hash "
+                                   "WHERE f.name IN (" + ", ".join(["?"] * len(chunk)) + ")", chunk)
+            for name, iteration, sizes in rows:
+                allFingerprints.setdefault(name, {})[iteration] = np.frombuffer(sizes, dtype="<i4").tolist()
+        return allFingerprints
+
+    # Sorted index over the image sizes of all fingerprints: the profile names, the name index of each fingerprint,
+    # and the sorted sizes with the fingerprint they belong to. Only fingerprints with at least 'numberImages' images are used.
+    def loadSortedIndex(self, numberImages):
+        generation = self.db.execute("SELECT value FROM generation WHERE id = 0").fetchone()[0]
+        row = self.db.execute("SELECT generation, names, fingerprintNames, sizes, owners FROM sortedIndex WHERE id = 0").fetchone()
+        if (row is None or row[0] != generation):
+            self.buildSortedIndex(generation)
+            row = self.db.execute("SELECT generation, names, fingerprintNames, sizes, owners FROM sortedIndex WHERE id = 0").fetchone()
+
+        allNames = row[1].decode("utf-8").split("\n") if len(row[1]) > 0 else []
+        fingerprintNames = np.frombuffer(row[2], dtype="<i4")
+        sizes = np.frombuffer(row[3], dtype="<i4")
+        owners = np.frombuffer(row[4], dtype="<i4")
+        numberSizes = np.bincount(owners, minlength=len(fingerprintNames))
+        if (numberSizes.size > 0 and numberSizes.min() < numberImages):
+            isUsed = (numberSizes >= numberImages)
+            sizes = sizes[isUsed[owners]]
+            owners = owners[isUsed[owners]]
+        return allNames, fingerprintNames, sizes, owners
+
+    def buildSortedIndex(self, generation):
+        allNames = []
+        fingerprintNames = []
+        allSizes = []
+        rows = self.db.execute("SELECT f.name, i.sizes FROM fingerprints f JOIN images i ON f.hash = i.hash ORDER BY f.name, f.iteration")
+        for name, sizes in rows:
+            if (len(allNames) == 0 or allNames[-1] != name):
+                allNames.append(name)
+            fingerprintNames.append(len(allNames) - 1)
+            allSizes.append(sizes)
+        sizes = np.frombuffer(b"".join(allSizes), dtype="<i4")
+        owners = np.repeat(np.arange(len(allSizes), dtype="<i4"), [len(s) // 4 for s in allSizes])
+        order = np.argsort(sizes, kind="stable")
+        self.db.execute("INSERT OR REPLACE INTO sortedIndex (id, generation, names, fingerprintNames, sizes, owners) VALUES (0, ?, ?, ?, ?, ?)",
+                        (generation, "\n".join(allNames).encode("utf-8"), np.array(fingerprintNames, dtype="<i4").tobytes(),
+                         sizes[order].tobytes(), owners[order].tobytes()))
+        self.db.commit()
+
+
+# Fingerprint of a profile ({iteration: sizes} of loadAll) for the given iteration, or of its last iteration
+# if that one is not in the store.
+def findFingerprint(allIterations, iteration):
+    if (not allIterations):
+        return []
+    if (iteration in allIterations):
+        return allIterations[iteration]
+    return allIterations[max(allIterations)]
+
+
+def readQueries(queriesPath):
+    queriesFile = open(queriesPath, "r")
+    allQueries = [q.strip() for q in queriesFile.readlines()]
+    queriesFile.close()
+    return allQueries
+
+
+# Store the image sizes of the traces of the given profiles (all iterations) of a dataset directory.
+# With 'skipDuplicates', a profile that is listed more than once in the queries file is only stored for its first index.
+def importProfiles(store, datasetDir, allQueries, allProfiles, numberIterations, skipDuplicates):
+    traceCache = TraceCache.openCache(datasetDir)
+    firstIndex = {}
+    for accounts in range(len(allQueries) - 1, -1, -1):
+        firstIndex[allQueries[accounts]] = accounts
+    numberFingerprints = 0
+    for accounts in allProfiles:
+        if (skipDuplicates and firstIndex[allQueries[accounts]] != accounts):
+            continue
+        for iter in range(0, numberIterations):
+            if (traceCache is not None):
+                traceIndex = traceCache.findTrace(accounts, iter)
+                if (traceIndex == -1):
+                    continue
+                imagesLen = traceCache.getImageSizes(traceIndex)
+            else:
+                fPath = TraceFormat.getTracePath(datasetDir, accounts, iter)
+                if (fPath is None):
+                    continue
+                imagesLen = TraceFormat.readTraceImages(fPath)
+            store.setFingerprint(allQueries[accounts], iter, imagesLen)
+            numberFingerprints += 1
+    store.commit()
+    return numberFingerprints
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 5 or sys.argv[1] not in ("build", "update") or (sys.argv[1] == "update" and len(sys.argv) < 6)):
+        print("Usage: python FingerprintStore.py build <store> <dataset_directory> <queries_file> [<number_iterations>]")
+        print("       python FingerprintStore.py update <store> <dataset_directory> <queries_file> <profile_index> [<number_iterations>]")
+        exit(1)
+
+    allQueries = readQueries(sys.argv[4])
+    store = FingerprintStore(sys.argv[2])
+    if (sys.argv[1] == "build"):
+        numberIterations = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+        allProfiles = range(0, len(allQueries))
+    else:
+        numberIterations = int(sys.argv[6]) if len(sys.argv) > 6 else 1
+        allProfiles = [int(sys.argv[5])]
+        # Iterations that are no longer in the dataset are removed as well.
+        store.removeProfile(allQueries[allProfiles[0]])
+    numberFingerprints = importProfiles(store, sys.argv[3], allQueries, allProfiles, numberIterations, sys.argv[1] == "build")
+    # Rebuild the sorted index right away, so an online matcher does not have to do it when it starts.
+    store.loadSortedIndex(0)
+    store.close()
+    print("Stored " + repr(numberFingerprints) + " fingerprints in " + sys.argv[2])
@@ -0,0 +1,171 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Incremental parsers for the start of a proxied TLS connection: the HTTP CONNECT request to the proxy and the
+# Client Hello with its server_name extension (SNI). Shared by tcpproxy.py, ImprovedIUPTIS_COLLECT.py and PcapReader.py.
+
+import struct
+
+
+# Server name in the server_name extension of a Client Hello handshake message (the body of its handshake records).
+# Returns None if it is not a Client Hello or if it has no server name.
+def parseServerName(handshake):
+    if (len(handshake) < 4 or handshake[0] != 1):
+        return None
+    end = min(len(handshake), 4 + int.from_bytes(handshake[1:4], "big"))
+    # Skip the version and random.
+    offset = 4 + 2 + 32
+    # Skip the session id, cipher suites and compression methods.
+    if (offset + 1 > end):
+        return None
+    offset += 1 + handshake[offset]
+    if (offset + 2 > end):
+        return None
+    offset += 2 + struct.unpack_from(">H", handshake, offset)[0]
+    if (offset + 1 > end):
+        return None
+    offset += 1 + handshake[offset]
+    if (offset + 2 > end):
+        return None
+    extensionsEnd = min(end, offset + 2 + struct.unpack_from(">H", handshake, offset)[0])
+    offset += 2
+
+    while (offset + 4 <= extensionsEnd):
+        extensionType, extensionLength = struct.unpack_from(">HH", handshake, offset)
+        offset += 4
+        if (extensionType == 0):
+            # List of (name type, name length, name), after the length of the list.
+            position = offset + 2
+            listEnd = min(offset + extensionLength, extensionsEnd)
+            while (position + 3 <= listEnd):
+                nameType, nameLength = struct.unpack_from(">BH", handshake, position)
+                position += 3
+                if (nameType == 0 and position + nameLength <= listEnd):
+                    return bytes(handshake[position:position + nameLength])
+                position += nameLength
+            return None
+        offset += extensionLength
+    return None
+
+
+# Is the host name the targeted domain or one of its subdomains? A domain name starting with a dot (.cdninstagram.com)
+# only matches its subdomains.
+def isTargetedHost(hostName, domainName):
+    hostName = hostName.lower()
+    domainName = domainName.lower()
+    if (domainName.startswith(b".")):
+        return hostName.endswith(domainName)
+    return hostName == domainName or hostName.endswith(b"." + domainName)
+
+
+# Finds the server name in the data that a client sends over a connection, which can arrive in pieces.
+# Data before the first TLS record (for instance the HTTP CONNECT request to the proxy) is skipped.
+# Once the decision is made, it is kept and the parser ignores all further data.
+class ClientHelloParser(object):
+    def __init__(self):
+        self.buffer = bytearray()
+        self.handshake = bytearray()
+        self.hasStarted = False
+        self.isDone = False
+        self.serverName = None
+
+    # Returns True as soon as the decision is made. 'serverName' is then the server name, or None if there is none.
+    def feed(self, data):
+        if (self.isDone):
+            return True
+        self.buffer += data
+        while (True):
+            if (not self.hasStarted):
+                index = self.buffer.find(b"\x16\x03")
+                if (index == -1):
+                    del self.buffer[:-1]
+                    return False
+                del self.buffer[:index]
+            if (len(self.buffer) < 5):
+                return False
+            if (self.buffer[0] != 22 or self.buffer[1] != 3 or self.buffer[2] > 4):
+                if (self.hasStarted):
+                    # The Client Hello ended without being complete.
+                    return self.finish(None)
+                del self.buffer[0]
+                continue
+
+            self.hasStarted = True
+            recordLength = struct.unpack_from(">H", self.buffer, 3)[0]
+            if (len(self.buffer) < 5 + recordLength):
+                return False
+            self.handshake += self.buffer[5:5 + recordLength]
+            del self.buffer[:5 + recordLength]
+            # A large Client Hello can span multiple handshake records.
+            if (len(self.handshake) >= 4 and len(self.handshake) >= 4 + int.from_bytes(self.handshake[1:4], "big")):
+                return self.finish(parseServerName(self.handshake))
+
+    def finish(self, serverName):
+        self.serverName = serverName
+        self.isDone = True
+        self.buffer = None
+        self.handshake = None
+        return True
+
+
+# Parses the HTTP CONNECT request that a client sends to the proxy, which can arrive in pieces.
+# Only the new data is searched for the end of the request.
+class ConnectRequestParser(object):
+    def __init__(self):
+        self.buffer = bytearray()
+        self.searchedUntil = 0
+
+    # Returns (isComplete, host name, port).
+    def feed(self, data):
+        self.buffer += data
+        end = self.buffer.find(b"\r\n\r\n", max(0, self.searchedUntil - 3))
+        if (end == -1):
+            self.searchedUntil = len(self.buffer)
+            return False, "", ""
+
+        request = bytes(self.buffer[:end])
+        requestLine, _, headers = request.partition(b"\r\n")
+        parts = requestLine.split(b" ")
+        # The target of 'CONNECT <host>:<port> HTTP/1.1', otherwise the Host header.
+        if (len(parts) >= 2 and parts[0] == b"CONNECT"):
+            target = parts[1]
+        else:
+            target = b""
+            for header in headers.split(b"\r\n"):
+                name, _, value = header.partition(b":")
+                if (name.strip().lower() == b"host"):
+                    target = value.strip()
+                    break
+
+        hostName, separator, port = target.rpartition(b":")
+        if (not separator or not port.isdigit()):
+            return True, target, b"80"
+        return True, hostName, port
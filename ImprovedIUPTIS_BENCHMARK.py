@@ -0,0 +1,191 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Benchmark of the stages of ImprovedIUPTIS_PERFORM.py on the dataset of a PERFORM config file.
+# Each stage is timed separately and the results (seconds, records/sec, pairs/sec and peak RSS) are written as JSON,
+# so runs with different engines, parameters or versions can be compared.
+# Usage: python ImprovedIUPTIS_BENCHMARK.py <config_file> [<output_file> [<precision_samples> [<pairs_per_sample>]]]
+
+import sys
+import io
+import json
+import time
+import resource
+import TraceFormat
+
+
+if (len(sys.argv) < 2):
+    print("Usage: python ImprovedIUPTIS_BENCHMARK.py <config_file> [<output_file> [<precision_samples> [<pairs_per_sample>]]]")
+    exit(1)
+
+configName = sys.argv[1]
+outputName = sys.argv[2] if len(sys.argv) > 2 else ""
+# Number of samples used for the precision loop, which is quadratic in the number of samples.
+precisionSamples = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+# Number of fingerprints that each sample is compared with for the matching functions.
+pairsPerSample = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+# ImprovedIUPTIS_PERFORM.py reads its config from the command line when it is imported.
+sys.argv = ["ImprovedIUPTIS_PERFORM.py", configName]
+import ImprovedIUPTIS_PERFORM as perform
+
+
+# Peak resident set size of this process in KB.
+def getPeakRSS():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timeStage(allStages, name, function, countName="", count=0):
+    startTime = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - startTime
+    stage = {"seconds": seconds}
+    if (countName != ""):
+        stage[countName] = count
+        stage[countName + "PerSec"] = count / seconds if seconds > 0 else 0
+    stage["peakRSSKB"] = getPeakRSS()
+    allStages[name] = stage
+    print(name + ": " + ("%.3f" % seconds) + " s", file=sys.stderr)
+    return result
+
+
+# All traces of the dataset in memory (the lines of a text trace, the bytes of a binary trace), so getResp is timed
+# without reading the files. The traces are the same as those of loadTraces, in either format (see TraceFormat.py).
+# Returns the traces and their number of TLS records.
+def readAllTraces():
+    allTraces = []
+    numberRecords = 0
+    for accounts in range(0, perform.numberAccounts):
+        for iter in range(0, perform.numberIterations):
+            fPath = TraceFormat.getTracePath(perform.rootDir + perform.datasetPath, accounts, iter)
+            if (fPath is None):
+                continue
+            if (TraceFormat.isBinaryTrace(fPath)):
+                traceData = open(fPath, "rb")
+                allTraces.append(traceData.read())
+                traceData.close()
+                imageSizes, connections = TraceFormat.readTraceFile(fPath)
+                numberRecords += sum(len(connection) for connection in connections)
+            else:
+                traceData = open(fPath, "r")
+                allTraces.append(traceData.readlines()[1:])
+                traceData.close()
+                # TLS records, without the lines that separate the TCP connections.
+                numberRecords += sum(1 for record in TraceFormat.iterRecords(allTraces[-1]) if record is not None)
+    return allTraces, numberRecords
+
+
+# Responses of a trace of readAllTraces, extracted in the same way as loadTraces does for its format.
+def getTraceResp(trace):
+    if (isinstance(trace, bytes)):
+        imageSizes, connections = TraceFormat.readBinaryTrace(io.BytesIO(trace))
+        return perform.getRespColumns([connection.getArrays() for connection in connections])
+    return perform.getResp(trace)
+
+
+# Returns the number of pairs for which the matching function failed (jenkspy refuses sequences with less than
+# two different diffs), as they would also stop ImprovedIUPTIS_PERFORM.py.
+def runMatching(function, pairs, useJenks):
+    numberErrors = 0
+    for k, v in pairs:
+        try:
+            function(perform.allRespLen[k], perform.allImageLen[v], useJenks)
+        except ValueError:
+            numberErrors += 1
+    return numberErrors
+
+
+def runBenchmark():
+    allStages = {}
+
+    allTraces, numberRecords = readAllTraces()
+    timeStage(allStages, "getResp", lambda: [getTraceResp(trace) for trace in allTraces], "records", numberRecords)
+    del allTraces
+
+    traceCache = perform.TraceCache.openCache(perform.rootDir + perform.datasetPath)
+    if (traceCache is not None):
+        # The same traces as above, from the compiled trace cache.
+        allTraceIndices = []
+        for accounts in range(0, perform.numberAccounts):
+            for iter in range(0, perform.numberIterations):
+                traceIndex = traceCache.findTrace(accounts, iter)
+                if (traceIndex != -1):
+                    allTraceIndices.append(traceIndex)
+        traceConnOffsets = traceCache.columns["traceConnOffsets"]
+        traceOffsets = traceCache.columns["traceOffsets"]
+        numberCacheRecords = sum(int(traceConnOffsets[traceOffsets[t + 1]] - traceConnOffsets[traceOffsets[t]]) for t in allTraceIndices)
+        timeStage(allStages, "getRespColumns", lambda: [perform.getRespColumns(traceCache.getConnections(t)) for t in allTraceIndices], "records", numberCacheRecords)
+
+    numberSamples = perform.numberAccounts * perform.numberIterations
+    loaded = timeStage(allStages, "loadTraces", perform.loadTraces, "traces", numberSamples)
+    perform.allRespLen, perform.allImageLen, allQueries, perform.candidateIndex = loaded
+
+    # Each sample with its own fingerprint and the next 'pairsPerSample' - 1 fingerprints.
+    usedSamples = [k for k in range(0, len(perform.allRespLen)) if len(perform.allImageLen[k]) > 0 and len(perform.allRespLen[k]) > 0]
+    pairs = []
+    for i, k in enumerate(usedSamples):
+        for offset in range(0, min(pairsPerSample, len(usedSamples))):
+            pairs.append((k, usedSamples[(i + offset) % len(usedSamples)]))
+    # Each matching function with and without Jenks, regardless of the config.
+    for name, function in [("calculateOrdered", perform.calculateOrdered), ("calculateOrderedNumpy", perform.calculateOrderedNumpy), ("calculateDiffs", perform.calculateDiffs)]:
+        for stageName, useJenks in [(name, False), (name + "Jenks", True)]:
+            numberErrors = timeStage(allStages, stageName, lambda: runMatching(function, pairs, useJenks), "pairs", len(pairs))
+            allStages[stageName]["errors"] = numberErrors
+
+    sensitivity = timeStage(allStages, "sensitivity", perform.evaluateSensitivity, "pairs", len(usedSamples))
+    perform.allBestSeq = sensitivity[1]
+
+    # The precision loop compares each sample with all fingerprints (the ones that are pruned by the candidate index included).
+    end = min(precisionSamples, len(perform.allRespLen))
+    timeStage(allStages, "precision", lambda: perform.evaluatePrecision(0, end), "pairs", end * len(perform.allImageLen))
+
+    return {
+        "config": configName,
+        "datasetPath": perform.datasetPath,
+        "matchingEngine": perform.matchingEngine,
+        "useImageOrder": perform.useImageOrder,
+        "useJenks": perform.doingJenks,
+        "useCandidateIndex": perform.useCandidateIndex,
+        "precisionSamples": end,
+        "pairsPerSample": pairsPerSample,
+        "stages": allStages,
+        "peakRSSKB": getPeakRSS(),
+    }
+
+
+if __name__ == "__main__":
+    benchmark = runBenchmark()
+    if (outputName != ""):
+        outputFile = open(outputName, "w")
+        outputFile.write(json.dumps(benchmark, indent=4))
+        outputFile.close()
+    else:
+        print(json.dumps(benchmark, indent=4))
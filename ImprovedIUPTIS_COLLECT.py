@@ -21,6 +21,14 @@ from selenium.webdriver.firefox.options import Options
 import sys
 from subprocess import check_output
 import struct
+import select
+import multiprocessing
+import tcpproxy
+import PcapReader
+import HandshakeParser
+import FingerprintStore
+import TraceFormat
+from TraceFormat import getImageSizes, formatHeaderLine, RecordColumns
 
 
 
@@ -38,6 +46,7 @@ tempFolder = configParameters["tempFolder"]
 dataset = configParameters["datasetProfiles"]
 netInterface = configParameters["networkInterface"]
 hostName = str.encode(configParameters["domainName"])
+sslOverhead = configParameters["sslOverhead"]
 myIP = configParameters["ownIP"]
 iterations = configParameters["iterations"]
 startIteration = configParameters["startIteration"]
@@ -51,10 +60,30 @@ numberScrollsWebpage = configParameters["numberScrollsWebpage"]
 datasetDirectory = configParameters["datasetDirectory"]
 checkDomain = configParameters["checkDomain"] == "True"
 maxWaitingTime = configParameters["maxWaitingTime"]
+# Number of browsers that collect samples in parallel. Worker X uses the proxy on port 'proxyPort' + 2*X.
+numberWorkers = configParameters.get("numberWorkers", 1)
+proxyPort = configParameters.get("proxyPort", 81)
+# Number of samples that are collected with the same browser, before it is restarted.
+browserSessionSize = configParameters.get("browserSessionSize", 1)
+# If set, the images of each collected sample are also added to (or refreshed in) this fingerprint store (see FingerprintStore.py).
+fingerprintStore = configParameters.get("fingerprintStore", "")
+# Format of the samples: "text" ('<profile>_<iteration>.txt') or "binary" ('<profile>_<iteration>.trace', see TraceFormat.py),
+# and the compression of binary samples ("none", "lzma" or "zstd").
+traceFormat = configParameters.get("traceFormat", "text")
+traceCompression = configParameters.get("traceCompression", "none")
 configFile.close()
 
+if (traceFormat not in ("text", "binary")):
+    print("Error: Unknown trace format '" + traceFormat + "'.")
+    exit(1)
+if (traceCompression not in TraceFormat.COMPRESSIONS or (traceCompression == "zstd" and TraceFormat.zstandard is None)):
+    print("Error: Compression '" + traceCompression + "' is not available.")
+    exit(1)
+
 
 rootDir = os.getcwd() + "/"
+# Directory of URLS.txt and ready_iuptis, through which the add-on communicates with this script.
+channelDir = rootDir
 print("Own IP:" + repr(myIP))
 
 
@@ -63,65 +92,23 @@ def createExtensionZip(saveFile,folderName,ext):
     check_output(["mv", saveFile,saveFile[:-3]+ext])
 
 
-def getImageSizes(strURL,numberPhotos,profileName):
-    allPhotosLen = []
-    allPhotosTime = []
-    photosFound = 0
-    # Extract information from all the original images, saved by the add-on.
-    urlData = open(rootDir + "URLS.txt", "r+")
+# Records of all the original images, saved by the add-on in URLS.txt.
+def readURLRecords():
+    urlData = open(channelDir + "URLS.txt", "r+")
     if (not urlData):
         print("Error: Can't read from URLS.txt file. Are you sure the add-on is working properly?")
         exit(1)
     rawURLData = urlData.readlines()
     urlData.close()
-    allURLS = []
-    allStartTime = []
-    allEndTime = []
-    allLens = []
-    for line in rawURLData:
-        splitted = line.split(' ')
-        allURLS.append(splitted[0])
-        allLens.append(splitted[1])
-        allStartTime.append(int(float(splitted[2])*1000))
-        allEndTime.append(int(float(splitted[3][:-1])*1000))
-
-    lowestIndex = 0
-    if (len(allStartTime) == 0):
-        print("WARNING: No data hold.")
-        return False, [], []
-
-    while (True):
-        lowestIndex = allStartTime.index(min(allStartTime))
-        if (allStartTime[lowestIndex] == sys.maxsize):
-            break
-        allPhotosLen.append(int(allLens[lowestIndex]))
-        allPhotosTime.append([allStartTime[lowestIndex] * 100, allEndTime[lowestIndex] * 100])
-        allStartTime[lowestIndex] = sys.maxsize
-
-    if (len(allPhotosLen) < numberPhotos):
-        print("WARNING: Profile '" + profileName[:-1] + "' has only " + repr(len(allPhotosLen)) + " photos. Skipping...")
-        return False, [], []
-
-
-    return True, allPhotosLen, allPhotosTime
-
-
+    return rawURLData
 
 def getTargetedConnection(allData):
-    index = 0
-    # Check for client hello, then check if the SNI contains the domain that we are targetting.
-    while (len(allData) > index):
-        if (allData[index:index+3] == b"\x16\x03\x01"):
-            tlsDataLen = struct.unpack(">H", allData[index+3:index+5])[0]
-            tlsData = allData[index + 5:index+5+tlsDataLen]
-            # The domain name should be somewhere in the Client Hello record. Close enough.
-            foundIndex = tlsData.find(hostName)
-            if (foundIndex != -1):
-                print("Targeted host name found: " + str(tlsData[foundIndex:foundIndex+6]))
-                return True
-            else:
-                return False
-        index += 1
+    # Parse the Client Hello, then check if its SNI is the domain that we are targetting.
+    helloParser = HandshakeParser.ClientHelloParser()
+    if (helloParser.feed(allData) and helloParser.serverName is not None):
+        if (HandshakeParser.isTargetedHost(helloParser.serverName, hostName)):
+            print("Targeted host name found: " + str(helloParser.serverName))
+            return True
     return False
 
 
@@ -137,113 +124,143 @@ def getCorrespondingDump(fileDump):
 
 
 
-# TShark is not conform to the JSON standard and produces duplicate keys. This function will fix this.
-def join_duplicate_keys(ordered_pairs):
-    d = {}
-    for k, v in ordered_pairs:
-        if k in d:
-            if type(d[k]) == list:
-                d[k].append(v)
-            else:
-                newlist = []
-                newlist.append(d[k])
-                newlist.append(v)
-                d[k] = newlist
-        else:
-           d[k] = v
-    return d
-
-allSSLData = {}
-def addToSSLData(sslid,ssllen,stream,time):
-    global allSSLData
-    if sslid in allSSLData:
-        allSSLData[sslid]["streams"].append({"ssl_len": ssllen, "stream_id": int(stream), "time": int(float(time)*10000000)})
-    else:
-        allSSLData[sslid] = {"streams": [{"ssl_len": ssllen, "stream_id" : int(stream), "time": int(float(time)*10000000)}], "ssl_id": sslid}
-
-
-# Extract all TLS records from the JSON output produced by tshark.
-def analyzeTLSData(decData,direction):
-    global sslOverhead
-    sslIndex = 0
-    streamID = "-1"
-
-    #print("Analyzing TLS data in direction " + str(direction) + " ...")
-    for packet in decData:
-        frame = packet["_source"]["layers"]
-        if ((direction == -1 and frame["tcp"]["tcp.srcport"] != "81") or (direction == 1 and frame["tcp"]["tcp.dstport"] != "81")):
+# Extract all TLS records with application data in one direction (-1 from the proxy, 1 to the proxy) from a
+# pcap or pcapng capture of tcpdump. The TCP connections are reassembled by PcapReader.py, which only parses the TLS record headers.
+# Returns the records of each TCP connection as TraceFormat.RecordColumns.
+def analyzeTLSData(capturePath,direction):
+    allSSLData = {}
+    captureFile = open(capturePath, "rb")
+    for timestamp, streamIndex, recordDirection, contentType, length in PcapReader.iterTLSRecords(captureFile, proxyPort):
+        if (recordDirection != direction or contentType != 23):
             continue
-        timestamp = frame["frame"]["frame.time_epoch"]
-        ssl = frame["ssl"]
-        if "ssl.record" in ssl and "ssl.record.content_type" in ssl["ssl.record"]:
-            if (ssl["ssl.record"]["ssl.record.content_type"] != "23"):
-                continue
-            addToSSLData(sslIndex, int(ssl["ssl.record"]["ssl.record.length"]) - sslOverhead, streamID,timestamp)
-            sslIndex += 1
-        elif (type(ssl) == list):
-            tIndex = 0
-            while (len(ssl) > tIndex):
-                # Brutally killing TCPdump might leave half TLS records open. Ignore those.
-                if ("ssl.record" not in ssl[tIndex]):
-                    tIndex += 1
-                    continue
-                if (type(ssl[tIndex]["ssl.record"]) == list):
-                    t2Index = 0
-                    while (len(ssl[tIndex]["ssl.record"]) > t2Index and ssl[tIndex]["ssl.record"][t2Index]["ssl.record.content_type"] == "23"):
-                        addToSSLData(sslIndex,int(ssl[tIndex]["ssl.record"][t2Index]["ssl.record.length"])-sslOverhead,streamID,timestamp)
-                        sslIndex += 1
-                        t2Index+=1
-                else:
-                    if (ssl[tIndex]["ssl.record"]["ssl.record.content_type"] == "23"):
-                        addToSSLData(sslIndex, int(ssl[tIndex]["ssl.record"]["ssl.record.length"])-sslOverhead,streamID,timestamp)
-                        sslIndex += 1
-                tIndex += 1
-        elif ("ssl.record" in ssl):
-            # Brutally killing TCPdump might leave half TLS records open. Ignore those.
-
-            tIndex = 0
-            try:
-                # If it errors here, you probably forgot to turn of TLS 1.3. (bug fix)
-                while (len(ssl["ssl.record"]) > tIndex and ssl["ssl.record"][tIndex]["ssl.record.content_type"] == "23"):
-                    addToSSLData(sslIndex, int(ssl["ssl.record"][tIndex]["ssl.record.length"]) - sslOverhead,streamID,timestamp)
-                    sslIndex += 1
-                    tIndex += 1
-            except Exception as e:
-                print(e)
-                print(str(ssl))
-        else:
-            print("Ehhhh?: " + repr(ssl))
+        if (streamIndex not in allSSLData):
+            allSSLData[streamIndex] = RecordColumns()
+        allSSLData[streamIndex].append(int(timestamp*1000000), length - sslOverhead, recordDirection)
+    captureFile.close()
 
+    return allSSLData
 
-    return allSSLData.copy()
 
 
 
 
+# Event channel with DataCollector.py. It sends each image record of the add-on and *READY* over a Unix socket
+# as soon as it gets them, so we do not have to poll for the ready_iuptis file.
+class AddonChannel(object):
+    def __init__(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(4)
+        self.conn = None
+        self.buffer = b""
+        self.records = []
+        self.isReady = False
+
+    def reset(self):
+        self.records = []
+        self.isReady = False
+
+    def isConnected(self):
+        return self.conn is not None
+
+    # The browser is restarted, so the current DataCollector.py will be replaced.
+    def disconnect(self):
+        if (self.conn is not None):
+            self.conn.close()
+            self.conn = None
+
+    # Wait at most 'timeout' seconds for the next event. Returns True if something was received.
+    def waitForEvent(self, timeout):
+        readSockets = [self.server]
+        if (self.conn is not None):
+            readSockets.append(self.conn)
+        readable, writeable, exceptional = select.select(readSockets, [], [], max(timeout, 0))
+        received = False
+        for r in readable:
+            if r is self.server:
+                conn, address = self.server.accept()
+                self.disconnect()
+                self.conn = conn
+                self.buffer = b""
+                received = True
+            elif r is self.conn:
+                data = self.conn.recv(65536)
+                if not data:
+                    self.disconnect()
+                    continue
+                self.buffer += data
+                while (b"\n" in self.buffer):
+                    line, self.buffer = self.buffer.split(b"\n", 1)
+                    if (line == b"*READY*"):
+                        self.isReady = True
+                    else:
+                        self.records.append(line.decode() + "\n")
+                received = True
+        return received
+
+    # Handle all events that have already arrived, without waiting.
+    def drainEvents(self):
+        while (self.waitForEvent(0)):
+            pass
+
+    # Wait at most 'timeout' seconds for a DataCollector.py to connect.
+    def waitForConnection(self, timeout):
+        deadline = time.time() + timeout
+        while (not self.isConnected() and time.time() < deadline):
+            self.waitForEvent(deadline - time.time())
+        return self.isConnected()
+
 
 # When this function returns, the add-on has sent a signal telling our script that all necessary images are downloaded.
 def isAddonReady():
-    return os.path.isfile("ready_iuptis")
+    if (addonChannel.isReady or len(addonChannel.records) >= numberImagesPerProfile):
+        return True
+    return os.path.isfile(channelDir + "ready_iuptis")
 
 def waitForReady():
-    counter = 0
-    # Signaling through a file.
-    while (not os.path.isfile("ready_iuptis")):
-        counter += 1
-        if (counter > maxWaitingTime):
+    deadline = time.time() + maxWaitingTime
+    while (not isAddonReady()):
+        remaining = deadline - time.time()
+        if (remaining <= 0):
             print("Timeout add-on.")
             break
-        time.sleep(1)
+        # Without a connected DataCollector.py, fall back to checking the ready_iuptis file every second.
+        if (addonChannel.isConnected()):
+            addonChannel.waitForEvent(remaining)
+        else:
+            addonChannel.waitForEvent(min(remaining, 1))
 
     print("Add-on is ready.")
 
+# Wait until the page has grown after a scroll, the add-on is ready or 'timeout' seconds have passed. Returns the page height.
+def waitForScroll(driverX, lastHeight, timeout):
+    if (not addonChannel.isConnected()):
+        time.sleep(timeout)
+        return driverX.execute_script("return document.body.scrollHeight")
+
+    deadline = time.time() + timeout
+    newHeight = lastHeight
+    while (not isAddonReady() and time.time() < deadline):
+        # New images are a sign that the page has loaded more content.
+        if (addonChannel.waitForEvent(deadline - time.time())):
+            newHeight = driverX.execute_script("return document.body.scrollHeight")
+            if (newHeight != lastHeight):
+                break
+    return driverX.execute_script("return document.body.scrollHeight")
+
 
 
 def clearUp():
+    addonChannel.reset()
+    # URLS.txt is truncated instead of removed, as DataCollector.py keeps it open while the browser is reused.
     try:
-        os.remove(rootDir + "URLS.txt")
-        os.remove(rootDir + "ready_iuptis")
-        os.remove(rootDir + "output.pcap")
+        open(channelDir + "URLS.txt", "w").close()
+        os.remove(channelDir + "ready_iuptis")
+        os.remove(channelDir + "output.pcap")
     except:
         pass
 
@@ -293,7 +310,7 @@ def setupBrowser(browserType):
             profile.set_preference("network.proxy.share_proxy_settings", True)
             firefox_capabilities = webdriver.DesiredCapabilities.FIREFOX
             firefox_capabilities['marionette'] = True
-            PROXY = myIP+":81"
+            PROXY = myIP + ":" + str(proxyPort)
             firefox_capabilities['proxy'] = {
                 "proxyType": "MANUAL",
                 "httpProxy": PROXY,
@@ -301,6 +318,9 @@ def setupBrowser(browserType):
                 "sslProxy": PROXY
             }
 
+        # A reused browser is reset from the chrome context (see resetBrowser), which newer versions of Firefox only allow with this variable.
+        if (browserSessionSize > 1):
+            os.environ["MOZ_REMOTE_ALLOW_SYSTEM_ACCESS"] = "1"
         binary = FirefoxBinary(firefoxPath)
         options = Options()
         options.headless = useHeadless
@@ -312,7 +332,7 @@ def setupBrowser(browserType):
         options = webdriver.ChromeOptions()
         options.headless = False
         options.add_argument("--ssl-version-max=tls1.2")
-        PROXY = myIP + ":81"
+        PROXY = myIP + ":" + str(proxyPort)
         options.add_argument("--proxy-server=" + PROXY)
         #options.add_argument("--enable-logging")
         #options.add_argument("--v=1")
@@ -327,6 +347,34 @@ def setupBrowser(browserType):
         print("Error: Unknown browser type.")
         exit(1)
 
+# Reset a browser that will be reused for the next sample, so it behaves like a new one.
+# The add-on resets itself when the next webpage is requested.
+def resetBrowser(driverX):
+    # Storage can only be cleared from a page of the same origin, so do it before leaving the webpage.
+    # The script only returns when all of it is cleared. A database that is still open by the webpage blocks its
+    # deletion until the webpage is left, which is done right after.
+    driverX.execute_async_script("""
+        var done = arguments[arguments.length - 1];
+        window.localStorage.clear();
+        window.sessionStorage.clear();
+        var pending = [];
+        if (window.caches) pending.push(caches.keys().then(function(keys) { return Promise.all(keys.map(function(key) { return caches.delete(key); })); }));
+        if (navigator.serviceWorker) pending.push(navigator.serviceWorker.getRegistrations().then(function(regs) { return Promise.all(regs.map(function(reg) { return reg.unregister(); })); }));
+        if (window.indexedDB && indexedDB.databases) pending.push(indexedDB.databases().then(function(dbs) { return Promise.all(dbs.map(function(db) {
+            return new Promise(function(resolve) { var request = indexedDB.deleteDatabase(db.name); request.onsuccess = request.onerror = request.onblocked = resolve; });
+        })); }));
+        Promise.all(pending).then(function() { done(true); }, function() { done(false); });
+    """)
+    # The HTTP cache, the image cache and the cookies of all domains (also of the CDN and third parties) can only be
+    # cleared by the browser itself, from the chrome context.
+    with driverX.context(driverX.CONTEXT_CHROME):
+        driverX.execute_script("""
+            Services.cache2.clear();
+            Components.classes["@mozilla.org/image/tools;1"].getService(Components.interfaces.imgITools).getImgCacheForDocument(null).clearCache(false);
+            Services.cookies.removeAll();
+        """)
+    driverX.get("about:blank")
+
 def collectWebpage(driverX,prefix,webpage):
     driverX.get(prefix + webpage)
     if (numberScrollsWebpage > 0):
@@ -341,23 +389,21 @@ def collectWebpage(driverX,prefix,webpage):
             # Scroll down to bottom
             driverX.execute_script("window.scrollTo(0, document.body.scrollHeight);")
 
-            # Wait to load page
-            time.sleep(SCROLL_PAUSE_TIME)
-
-            # Calculate new scroll height and compare with last scroll height
-            new_height = driverX.execute_script("return document.body.scrollHeight")
+            # Wait to load page and calculate new scroll height and compare with last scroll height
+            new_height = waitForScroll(driverX, last_height, SCROLL_PAUSE_TIME)
             if new_height == last_height:
                 break
             last_height = new_height
 
+# The proxy writes its TLS records in the text format (0x01) or in the binary format (0x05).
 def signalProxy():
     global proxySock
-    while(proxySock.send(b"\x01") != 1):
+    while(proxySock.send(b"\x05" if traceFormat == "binary" else b"\x01") != 1):
         continue
     commResp = proxySock.recv(1)
     if (commResp != b"\xff"):
         print("ERROR: Unexpected response from proxy socket. Exiting ...")
-        exit(0)
+        exit(1)
 
 def clearProxy():
     global proxySock
@@ -366,64 +412,164 @@ def clearProxy():
     commResp = proxySock.recv(1)
     if (commResp != b"\xff"):
         print("ERROR: Unexpected response from proxy socket. Exiting ...")
-        exit(0)
+        exit(1)
+
+# Let the proxy close all connections of the browser, so the next sample does not reuse them.
+def closeProxyConnections():
+    global proxySock
+    while (proxySock.send(b"\x03") != 1):
+        continue
+    commResp = proxySock.recv(1)
+    if (commResp != b"\xff"):
+        print("ERROR: Unexpected response from proxy socket. Exiting ...")
+        exit(1)
 
-def runNormalMode():
+def connectProxy(commPort):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 120)
+    sock.connect(('127.0.0.1', commPort))
+    resp = sock.recv(1)
+    if (resp == b"\xff"):
+        print("Communication socket with proxy on port " + repr(commPort) + " is established.")
+    else:
+        print("Communication socket of proxy is not ready. Exiting ...")
+        exit(1)
+    return sock
+
+def runNormalMode(allProfiles):
+    global addonChannel
     print("Running normal mode ....")
-    # Create the zip extension for the add-on.
-    createExtensionZip(rootDir + "extension.zip", rootDir + "Extension","xpi")
-    photosLen = []
+    addonChannel = AddonChannel(channelDir + "iuptis.sock")
+    images = None
+    stats = {"samples": 0, "skippedProfiles": 0, "timeouts": 0, "webdriverErrors": 0}
+    startTime = time.time()
+    driverX = None
+    sessionSamples = 0
     # We iterate over all profiles/queries.
-    for v in range(startIndexProfile, len(allPages)):
+    for v in allProfiles:
         # Number of iterations per profile/query.
         for i in range(startIteration, iterations+startIteration):
             allRecords = []
             try:
                 clearUp()
-                driverX = setupBrowser("firefox")
-                time.sleep(2)
+                if (driverX is None):
+                    addonChannel.disconnect()
+                    driverX = setupBrowser("firefox")
+                    sessionSamples = 0
+                    # The DataCollector.py of the add-on connects as soon as the add-on is running.
+                    addonChannel.waitForConnection(2)
                 # Visit the webpage.
                 print("Requesting profile '" + allPages[v][:-1] + "' ...")
                 collectWebpage(driverX,prefixWebpage,allPages[v])
                 # Wait until we have downloaded all necessary images (this is communicated through the add-on)
                 waitForReady()
-                time.sleep(4)
-                driverX.quit()
-                time.sleep(2)
+                # Without events, give the last responses some time, as we do not know when they were completed.
+                usedEvents = addonChannel.isConnected()
+                if (not usedEvents):
+                    time.sleep(4)
+                sessionSamples += 1
+                if (sessionSamples < browserSessionSize):
+                    resetBrowser(driverX)
+                else:
+                    driverX.quit()
+                    driverX = None
+                if (not usedEvents):
+                    time.sleep(2)
                 # Signal proxy to dump the TLS record information.
                 signalProxy()
+                if (driverX is not None):
+                    closeProxyConnections()
                 # Get the original lengths of the images on the webpage.
-                isSuccess, photosLen, photosTime = getImageSizes(hostName, numberImagesPerProfile, allPages[v])
+                # With events, the records are already in memory and URLS.txt does not have to be read back.
+                if (usedEvents):
+                    addonChannel.drainEvents()
+                    urlRecords = addonChannel.records
+                else:
+                    urlRecords = readURLRecords()
+                isSuccess, images = getImageSizes(urlRecords, numberImagesPerProfile, allPages[v])
                 if (not isSuccess):
                     print("Skipping this iteration.")
+                    stats["skippedProfiles"] += 1
                     break
             except TimeoutError as e:
                 print("WARNING: Failed to load in time with message -> " + repr(e))
+                stats["timeouts"] += 1
                 stopTcpdump()
                 driverX.quit()
+                driverX = None
                 time.sleep(3)
                 continue
             except selenium.common.exceptions.WebDriverException as e:
                 print("WARNING: WebDriver threw an exception. Error: " + repr(e) + ". Skipping this one ...")
+                stats["webdriverErrors"] += 1
                 try:
                     driverX.quit()
                 except:
                     pass
+                driverX = None
                 continue
 
             print("Iteration " + repr(i) + ": Traffic of account " + allPages[v][:-1] + "(" + repr(v) + ") is captured. Writing to file...")
-            sampleData = open(rootDir + "/" + datasetDirectory + repr(v) + "_" + repr(i) + ".txt", "w+")
-            strPhotosLen = repr(' '.join(str(p) for p in photosLen))
-
-            fTls = open("tls_output.txt", "r")
-            # Write out all the original photo lengths.
-            sampleData.write("### " + repr(strPhotosLen) + "\n")
-            # Write out each SSL record with the time when it was received, the length and whether it was received or sent.
-            sampleData.write(fTls.read())
-            sampleData.close()
-            fTls.close()
+            if (traceFormat == "binary"):
+                # The records of the proxy are read back and written with the images as one binary trace.
+                fTls = open(tcpproxy.getOutputFileName(proxyPort, ".trace"), "rb")
+                proxyImages, connections = TraceFormat.readBinaryTrace(fTls)
+                fTls.close()
+                sampleData = open(rootDir + "/" + datasetDirectory + repr(v) + "_" + repr(i) + ".trace", "wb")
+                TraceFormat.writeBinaryTrace(sampleData, images["length"].tolist(), connections, traceCompression)
+                sampleData.close()
+            else:
+                sampleData = open(rootDir + "/" + datasetDirectory + repr(v) + "_" + repr(i) + ".txt", "w+")
+
+                fTls = open(tcpproxy.getOutputFileName(proxyPort), "r")
+                # Write out all the original photo lengths.
+                sampleData.write(formatHeaderLine(images["length"].tolist()))
+                # Write out each SSL record with the time when it was received, the length and whether it was received or sent.
+                sampleData.write(fTls.read())
+                sampleData.close()
+                fTls.close()
+            if (fingerprintStore != ""):
+                store = FingerprintStore.FingerprintStore(rootDir + fingerprintStore)
+                store.setFingerprint(allPages[v].strip(), i, images["length"].tolist())
+                store.commit()
+                store.close()
+            stats["samples"] += 1
             print("Done iteration.\n")
 
+    if (driverX is not None):
+        driverX.quit()
+    stats["elapsedTime"] = time.time() - startTime
+    return stats
+
+
+# Worker X collects every X'th profile with its own browser, proxy (see tcpproxy.py), add-on channel and temporary folder.
+# Its stats are sent back over 'statsConn'.
+def runWorker(workerIndex, statsConn):
+    global proxyPort, channelDir, tempFolder, proxySock
+    proxyPort = proxyPort + 2 * workerIndex
+    channelDir = rootDir + "worker_" + repr(workerIndex) + "/"
+    tempFolder = tempFolder + "_" + repr(workerIndex)
+    os.makedirs(channelDir, exist_ok=True)
+    os.makedirs(tempFolder, exist_ok=True)
+    # DataCollector.py is started by the browser of this worker and inherits this variable.
+    os.environ["IUPTIS_CHANNEL_DIR"] = channelDir
+    proxySock = connectProxy(proxyPort + 1)
+
+    allProfiles = range(startIndexProfile + workerIndex, len(allPages), numberWorkers)
+    stats = runNormalMode(allProfiles)
+    stats["worker"] = workerIndex
+    proxySock.close()
+    statsConn.send(stats)
+    statsConn.close()
+
+
+def printStats(allStats):
+    for stats in allStats:
+        samplesPerHour = stats["samples"] / max(stats["elapsedTime"], 1) * 3600
+        print("Worker " + repr(stats.get("worker", 0)) + ": " + repr(stats["samples"]) + " samples in " + str(int(stats["elapsedTime"])) + " s (" +
+              str(round(samplesPerHour, 1)) + " samples/hour), " + repr(stats["skippedProfiles"]) + " skipped profiles, " +
+              repr(stats["timeouts"]) + " timeouts, " + repr(stats["webdriverErrors"]) + " WebDriver errors.")
+
 
 
 # Open the dataset
@@ -432,23 +578,38 @@ allPages = accounts.readlines()
 accounts.close()
 # Make sure tcpdump is not already running.
 stopTcpdump()
-
-proxySock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-proxySock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 120)
-proxySock.connect(('127.0.0.1', 82))
-resp = proxySock.recv(1)
-if (resp == b"\xff"):
-    print("Communication socket with proxy is established.")
+# Create the zip extension for the add-on.
+createExtensionZip(rootDir + "extension.zip", rootDir + "Extension","xpi")
+
+numberFailedWorkers = 0
+if (numberWorkers > 1):
+    # One process per worker instead of a pool, so a worker that stops (for instance with exit() after a proxy error)
+    # is reported instead of leaving the collection waiting for its stats forever.
+    context = multiprocessing.get_context("fork")
+    allWorkers = []
+    for workerIndex in range(0, numberWorkers):
+        statsConn, workerConn = context.Pipe(False)
+        worker = context.Process(target=runWorker, args=(workerIndex, workerConn))
+        worker.start()
+        workerConn.close()
+        allWorkers.append((worker, statsConn))
+    allStats = []
+    for workerIndex, (worker, statsConn) in enumerate(allWorkers):
+        worker.join()
+        try:
+            allStats.append(statsConn.recv())
+        except EOFError:
+            print("Error: Worker " + repr(workerIndex) + " stopped with exit code " + repr(worker.exitcode) + " before collecting all of its profiles.")
+            numberFailedWorkers += 1
+        statsConn.close()
 else:
-    print("Communication socket of proxy is not ready. Exiting ...")
-    exit(1)
-
-
-runNormalMode()
-
+    proxySock = connectProxy(proxyPort + 1)
+    allStats = [runNormalMode(range(startIndexProfile, len(allPages)))]
 
+printStats(allStats)
+if (numberFailedWorkers > 0):
+    exit(1)
 print("END")
 
 
 
-
@@ -0,0 +1,142 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Offline conversion of archived captures to a dataset of traces, without collecting them again.
+# Each capture '<profile>_<iteration>.pcap' (or .pcapng) in 'captureDirectory' is combined with the URL log of the
+# add-on '<profile>_<iteration>.txt' (a copy of URLS.txt) in 'urlDirectory' into the trace '<profile>_<iteration>.txt'.
+# Usage: python ImprovedIUPTIS_CONVERT.py <config_file>
+
+import sys
+import os
+import re
+import json
+import multiprocessing
+import PcapReader
+import TraceFormat
+
+
+CAPTURE_NAME = re.compile(r"^(\d+)_(\d+)\.(pcap|pcapng)$")
+
+if (len(sys.argv) < 2):
+    print("Usage: python ImprovedIUPTIS_CONVERT.py <config_file>")
+    exit(1)
+
+configName = sys.argv[1]
+configFile = open(configName, "r")
+jsonData = configFile.read()
+configParameters = json.loads(jsonData)
+hostName = str.encode(configParameters["domainName"])
+sslOverhead = configParameters["sslOverhead"]
+numberImagesPerProfile = configParameters["numberImagesPerProfile"]
+datasetDirectory = configParameters["datasetDirectory"]
+checkDomain = configParameters["checkDomain"] == "True"
+captureDirectory = configParameters.get("captureDirectory", "captures/")
+urlDirectory = configParameters.get("urlDirectory", "urls/")
+# Port of the captured TLS connections (for instance the port of the proxy), 0 for all ports.
+capturePort = configParameters.get("capturePort", 0)
+numberWorkers = configParameters.get("numberWorkers", 1)
+# Format and compression of the samples, as in ImprovedIUPTIS_COLLECT.py.
+traceFormat = configParameters.get("traceFormat", "text")
+traceCompression = configParameters.get("traceCompression", "none")
+
+if (traceFormat not in ("text", "binary")):
+    print("Error: Unknown trace format '" + traceFormat + "'.")
+    exit(1)
+if (traceCompression not in TraceFormat.COMPRESSIONS or (traceCompression == "zstd" and TraceFormat.zstandard is None)):
+    print("Error: Compression '" + traceCompression + "' is not available.")
+    exit(1)
+
+rootDir = os.getcwd() + "/"
+
+
+# Convert a single capture. Returns "converted", "skipped" or "failed".
+def convertCapture(captureName):
+    match = CAPTURE_NAME.match(captureName)
+    sampleName = match.group(1) + "_" + match.group(2) + ".txt"
+    urlPath = rootDir + urlDirectory + sampleName
+    if (not os.path.isfile(urlPath)):
+        print("WARNING: No URL log for capture '" + captureName + "'. Skipping...")
+        return "skipped"
+
+    urlData = open(urlPath, "r")
+    isSuccess, images = TraceFormat.getImageSizes(urlData.readlines(), numberImagesPerProfile, sampleName + "\n")
+    urlData.close()
+    if (not isSuccess):
+        return "skipped"
+
+    # Only the application data of the targeted connections, in the order of their first record.
+    connections = {}
+    try:
+        captureFile = open(rootDir + captureDirectory + captureName, "rb")
+        serverPort = capturePort if capturePort > 0 else None
+        domainName = hostName if checkDomain else None
+        for timestamp, streamIndex, direction, contentType, length in PcapReader.iterTLSRecords(captureFile, serverPort, domainName):
+            if (contentType != 23):
+                continue
+            if (streamIndex not in connections):
+                connections[streamIndex] = TraceFormat.RecordColumns()
+            connections[streamIndex].append(int(timestamp * 1000000), length - sslOverhead, direction)
+        captureFile.close()
+    except (OSError, ValueError) as e:
+        print("WARNING: Can't read capture '" + captureName + "': " + repr(e) + ". Skipping...")
+        return "failed"
+
+    if (len(connections) == 0):
+        print("WARNING: No TLS records of '" + configParameters["domainName"] + "' in capture '" + captureName + "'. Skipping...")
+        return "skipped"
+
+    if (traceFormat == "binary"):
+        samplePath = rootDir + datasetDirectory + sampleName[:-4] + ".trace"
+    else:
+        samplePath = rootDir + datasetDirectory + sampleName
+    TraceFormat.writeTraceFile(samplePath, images["length"].tolist(), connections.values(), traceCompression)
+    return "converted"
+
+
+def runConversion():
+    allCaptures = sorted(c for c in os.listdir(rootDir + captureDirectory) if CAPTURE_NAME.match(c))
+    os.makedirs(rootDir + datasetDirectory, exist_ok=True)
+    print("Converting " + repr(len(allCaptures)) + " captures with " + repr(numberWorkers) + " worker(s) ...")
+
+    if (numberWorkers > 1):
+        pool = multiprocessing.Pool(numberWorkers)
+        allResults = pool.map(convertCapture, allCaptures, chunksize=4)
+        pool.close()
+        pool.join()
+    else:
+        allResults = [convertCapture(c) for c in allCaptures]
+
+    for status in ["converted", "skipped", "failed"]:
+        print(status.capitalize() + ": " + repr(allResults.count(status)))
+
+
+if __name__ == "__main__":
+    runConversion()
@@ -31,10 +31,20 @@
 
 import sys
 import os
+import time
 import math
 import re
+import multiprocessing
+import itertools
 import jenkspy
 import json
+import numpy as np
+import TraceCache
+import TraceFormat
+import Instrumentation
+import FingerprintStore
+from CandidateIndex import CandidateIndex
+from SequenceStats import calcSD
 
 
 
@@ -68,22 +78,75 @@ queriesPath = configParameters["queriesPath"]
 usingHTTP2 = (configParameters["usingHTTP2"] == "True")
 minDataSize = configParameters["minDataSize"]
 useImageOrder = (configParameters["useImageOrder"] == "True")
+# Engine used for ordered sequences: "python" (calculateOrdered) or "numpy" (calculateOrderedNumpy).
+matchingEngine = configParameters.get("matchingEngine", "python")
+# Only check the fingerprints that can possibly match a trace in the precision phase (see CandidateIndex.py).
+useCandidateIndex = (configParameters.get("useCandidateIndex", "True") == "True")
+# Number of processes for the precision phase, and the number of samples per scheduled task.
+numberWorkers = configParameters.get("numberWorkers", 1)
+profilesPerTask = configParameters.get("profilesPerTask", 16)
+# If set, each task writes its results to this directory as soon as it is finished.
+partialResultsPath = configParameters.get("partialResultsPath", "")
+# Opt-in instrumentation (see Instrumentation.py): time and calls per stage, and a profile of the whole run.
+useInstrumentation = (configParameters.get("instrumentation", "False") == "True")
+profiler = configParameters.get("profiler", "none")
+profileOutput = configParameters.get("profileOutput", "perform_profile")
+# Parameter sweep: a list of values for some of the parameters above. All combinations are evaluated in this process.
+sweepGrid = configParameters.get("sweep", {})
+sweepOutput = configParameters.get("sweepOutput", "sweep_results.csv")
+# If set, the images of each profile are taken from this fingerprint store (see FingerprintStore.py) instead of
+# from the header line of its traces.
+fingerprintStore = configParameters.get("fingerprintStore", "")
+# If set, the 'rankingTop' best ranked fingerprints of each sample (see identify) are written to this CSV file.
+rankingOutput = configParameters.get("rankingOutput", "")
+rankingTop = configParameters.get("rankingTop", 5)
 configFile.close()
 
+if (matchingEngine not in ("python", "numpy")):
+    print("Error: Unknown matching engine '" + matchingEngine + "'.")
+    exit(1)
+
+if (profiler not in ("none", "cprofile", "stacks")):
+    print("Error: Unknown profiler '" + profiler + "'.")
+    exit(1)
+
+# Global variable of each parameter that can be swept, and a function that converts its value from the config.
+SWEEP_PARAMETERS = {
+    "b_in": ("headerGuess", lambda v: v),
+    "pi_resp": ("rangeHeaderGuess", lambda v: v),
+    "sequence": ("minSequence", lambda v: v),
+    "maxSD": ("maxSD", lambda v: v),
+    "useJenks": ("doingJenks", lambda v: v == "True"),
+    "minFrame": ("noiseFrameSize", lambda v: v),
+    "minDataSize": ("minDataSize", lambda v: v),
+    "usingHTTP2": ("usingHTTP2", lambda v: v == "True"),
+    "caching": ("caching", lambda v: int((v/100) * numberImages)),
+}
+# The responses of a trace only depend on these parameters.
+RESPONSE_PARAMETERS = ["minFrame", "minDataSize", "usingHTTP2", "caching"]
+
+for parameterName in sweepGrid:
+    if (parameterName not in SWEEP_PARAMETERS):
+        print("Error: Parameter '" + parameterName + "' can not be swept.")
+        exit(1)
+
 
 
 rootDir = os.getcwd() + "/"
 
-# Compute the standard deviation
-def calcSD(arr):
-    total = 0
-    for g in arr:
-        total += g
-    mean = total / float(len(arr))
-    sum = 0
-    for g in arr:
-        sum += pow((g - mean), 2)
-    return math.sqrt(sum / float(len(arr)))
+# Standard deviations computed from running sums (or by NumPy) differ from calcSD in the last bits.
+# Within this relative distance of maxSD, calcSD itself is used, so each decision 'sd < maxSD' is exactly the same.
+SD_TOLERANCE = 1e-9
+# Maximum number of elements of a batch of difference windows in identify (for ordered sequences).
+IDENTIFY_BATCH = 1 << 22
+
+
+# Compute the standard deviation of arr[start:start+length] in O(1) from its sum and sum of squares.
+def calcRunningSD(total, totalSq, arr, start, length):
+    sd = math.sqrt(max(length * totalSq - total * total, 0)) / length
+    if (abs(sd - maxSD) <= SD_TOLERANCE * max(1.0, maxSD)):
+        return calcSD(arr[start:start + length])
+    return sd
 
 
 # Apply the Jenks optimization method on an array
@@ -113,55 +176,42 @@ def applyJenks(arr):
     return sdA,sdB
 
 
+# Yield the HTTP response lengths based on the TLS records, as soon as each response is finished.
+# Only the state of the current TCP connection is kept.
+def iterResp(records):
+    inPlus = False
+    totalResp = 0
+    lastTime = 0
+    for rec in records:
+        if (rec is None):
+            if (totalResp > minDataSize):
+                yield totalResp
+            inPlus = False
+            totalResp = 0
+            continue
+        sslRecTime, sslLen, sslDirection = rec
+        if (sslDirection < 0 and not inPlus):
+            if (sslLen >= noiseFrameSize or not usingHTTP2):
+                totalResp = sslLen
+                inPlus = True
+                lastTime = sslRecTime
+        elif (sslDirection < 0 and inPlus):
+            if (sslLen >= noiseFrameSize or not usingHTTP2):
+                totalResp += sslLen
+        elif (sslDirection > 0 and inPlus):
+            # Make sure we skip other small resources such as stylesheets or javascript files.
+            if (totalResp > minDataSize):
+                yield totalResp
+            totalResp = 0
+            inPlus = False
+    if (totalResp > minDataSize):
+        yield totalResp
+
+
+# Get the HTTP response lengths of a trace. 'arr' can be any iterable of lines, such as an opened trace file.
 def getResp(arr):
-    allConn = []
-    currConn = []
-
-    # Create a list where each element defines a TCP connection.
-    for line in arr:
-        tlsRec = line.replace('\n','').split(' ')
-        # Each TCP connection is seperated by 0,0,0.
-        if (tlsRec[0] == "0" and tlsRec[1] == "0"):
-            if (currConn != []):
-                allConn.append(currConn)
-            currConn = []
-        else:
-            currConn.append(tlsRec)
-    if (currConn != []):
-        allConn.append(currConn)
-
-    index = -1
-    respLengths = []
-    # Construct the HTTP response lengths based on the TLS records.
-    for conn in allConn:
-        index += 1
-        inPlus = False
-        totalResp = 0
-        lastTime = 0
-        for j in range(0,len(conn)):
-            sslRecTime = int(conn[j][0])
-            sslLen = int(conn[j][1])
-            sslDirection = int(conn[j][2])
-            if (sslDirection < 0 and not inPlus):
-                if (sslLen >= noiseFrameSize or not usingHTTP2):
-                    totalResp = sslLen
-                    inPlus = True
-                    lastTime = sslRecTime
-            elif (sslDirection < 0 and inPlus):
-                if (sslLen >= noiseFrameSize or not usingHTTP2):
-                    totalResp += sslLen
-            elif (sslDirection > 0 and inPlus):
-                # Make sure we skip other small resources such as stylesheets or javascript files.
-                if (totalResp > minDataSize):
-                    respLengths.append([totalResp, lastTime])
-                totalResp = 0
-                inPlus = False
-        if (totalResp > minDataSize):
-            respLengths.append([totalResp, lastTime])
-
-    resps = [item[0] for item in respLengths]
-
-    return resps[caching:]
+    # Use caching if wanted.
+    return list(itertools.islice(iterResp(TraceFormat.iterRecords(arr)), caching, None))
 
     # respLen = []
     # # Order the HTTP responses based on time.
@@ -181,44 +231,112 @@ def getResp(arr):
     # return respLen[caching:]
 
 
+# Yield the TLS records of the connections of a trace one by one, and None at the start of each TCP connection.
+def iterColumnRecords(connections):
+    for timestamps, lengths, directions in connections:
+        yield None
+        yield from zip(timestamps.tolist(), lengths.tolist(), directions.tolist())
+
+
+# Same as getResp, but for a trace of the columnar trace cache.
+def getRespColumns(connections):
+    return list(itertools.islice(iterResp(iterColumnRecords(connections)), caching, None))
+
+
 def calculateOrdered(responses,images,useJenks):
-    possibleDiff = []
+    respLen = [int(r) for r in responses]
+    imLen = [int(im) for im in images]
+    # Sequences of responses and images start at i < len(responses)-minSequence and p < len(images)-minSequence.
+    numberRespSeq = len(respLen) - minSequence
+    numberImSeq = len(imLen) - minSequence
+    if (numberRespSeq <= 0 or numberImSeq <= 0):
+        return False, -1
+
     isMade = False
-    bestSeq = -1
-    for currSequence in range(minSequence,minSequence+10):
-        for i in range(0,len(responses)-minSequence):
-            respSeq = responses[i:minSequence+i]
-            for p in range(0,len(images)-minSequence):
-                imSeq = images[p:minSequence+p]
-                diffArr = []
-                skipThis = False
-                for q in range(len(respSeq)):
-                    if (int(respSeq[q])-int(imSeq[q])-headerGuess >= rangeHeaderGuess):
-                        skipThis = True
-                        break
-                    diffArr.append(int(respSeq[q])-int(imSeq[q])-headerGuess)
-                if (skipThis):
-                    continue
-                # Do we apply Jenks optimization method?
+    jenksSeqs = []
+    # The diffs of sequence (i,p) lie on the diagonal (i+q,p+q), slide a window with running sums over each diagonal.
+    for offset in range(1 - numberRespSeq, numberImSeq):
+        firstI = max(0, -offset)
+        lastI = min(numberRespSeq, numberImSeq - offset)
+        diagonal = [respLen[i] - imLen[i + offset] - headerGuess for i in range(firstI, lastI + minSequence - 1)]
+        total = 0
+        totalSq = 0
+        outOfRange = 0
+        for q in range(0, minSequence - 1):
+            total += diagonal[q]
+            totalSq += diagonal[q] * diagonal[q]
+            outOfRange += (diagonal[q] >= rangeHeaderGuess)
+        for start in range(0, lastI - firstI):
+            newDiff = diagonal[start + minSequence - 1]
+            total += newDiff
+            totalSq += newDiff * newDiff
+            outOfRange += (newDiff >= rangeHeaderGuess)
+            if (outOfRange == 0):
+                # Do we apply Jenks optimization method? Then keep the sequence for later.
                 if (useJenks):
-                    sdA, sdB = applyJenks(diffArr)
-                else:
-                    sdA = calcSD(diffArr)
-                    sdB = sdA
-
+                    jenksSeqs.append([firstI + start, firstI + start + offset, diagonal[start:start + minSequence]])
                 # Make sure the standard deviation is smaller then H_{resp} and H_{req}.
-                if (sdA < maxSD and sdB < maxSD):
+                elif (calcRunningSD(total, totalSq, diagonal, start, minSequence) < maxSD):
                     isMade = True
                     break
-            if (isMade):
-                break
+            oldDiff = diagonal[start]
+            total -= oldDiff
+            totalSq -= oldDiff * oldDiff
+            outOfRange -= (oldDiff >= rangeHeaderGuess)
         if (isMade):
-            bestSeq = currSequence
-        else:
-            if (bestSeq != -1):
-                isMade = True
             break
-    return isMade,bestSeq
+
+    # Jenks is applied in the original order of the sequences (first by response, then by image).
+    jenksSeqs.sort(key=lambda seq: (seq[0], seq[1]))
+    for i, p, diffArr in jenksSeqs:
+        sdA, sdB = applyJenks(diffArr)
+        if (sdA < maxSD and sdB < maxSD):
+            isMade = True
+            break
+
+    # Sequences always have 'minSequence' elements, and once one is made, each following sequence length is
+    # accepted as well. So the best sequence is known as soon as the first sequence is found.
+    if (isMade):
+        return True, minSequence + 9
+    return False, -1
+
+
+# Vectorized version of calculateOrdered, returns the same (isMade, bestSeq).
+def calculateOrderedNumpy(responses,images,useJenks):
+    numberRespSeq = len(responses) - minSequence
+    numberImSeq = len(images) - minSequence
+    if (numberRespSeq <= 0 or numberImSeq <= 0):
+        return False, -1
+
+    # Difference matrix between each response and each image, built once.
+    diffMatrix = np.asarray(responses, dtype=np.int64)[:, None] - np.asarray(images, dtype=np.int64)[None, :] - headerGuess
+    # diffWindows[i, p] is the diagonal diffMatrix[i+q, p+q] for q < minSequence, the diffArr of calculateOrdered.
+    rowStride, colStride = diffMatrix.strides
+    diffWindows = np.lib.stride_tricks.as_strided(diffMatrix, shape=(numberRespSeq, numberImSeq, minSequence),
+                                                  strides=(rowStride, colStride, rowStride + colStride), writeable=False)
+    inRange = np.all(diffWindows < rangeHeaderGuess, axis=2)
+
+    isMade = False
+    if (useJenks):
+        # Jenks can not be vectorized, apply it on the windows in range in the same order as calculateOrdered.
+        for i, p in np.argwhere(inRange):
+            sdA, sdB = applyJenks(diffWindows[i, p].tolist())
+            if (sdA < maxSD and sdB < maxSD):
+                isMade = True
+                break
+    else:
+        allSD = diffWindows.std(axis=2)
+        isValid = inRange & (allSD < maxSD)
+        # NumPy sums in a different order than calcSD, recompute the windows close to maxSD with calcSD.
+        isBorder = inRange & (np.abs(allSD - maxSD) <= SD_TOLERANCE * max(1.0, maxSD))
+        for i, p in np.argwhere(isBorder):
+            isValid[i, p] = calcSD(diffWindows[i, p].tolist()) < maxSD
+        isMade = bool(isValid.any())
+
+    # calculateOrdered keeps isMade for all following sequence lengths, which are all accepted after one match.
+    if (isMade):
+        return True, minSequence + 9
+    return False, -1
 
 
 def calculateDiffs(responses,images,useJenks):
@@ -247,24 +365,46 @@ def calculateDiffs(responses,images,useJenks):
         else:
             possibleDiff.append(lowSecDiff)
 
+    # Running sums over the diffs (and over the responses not in range), so each sequence is checked in O(1).
+    numberDiffs = len(possibleDiff)
+    sumDiff = [0] * (numberDiffs + 1)
+    sumSqDiff = [0] * (numberDiffs + 1)
+    sumMissing = [0] * (numberDiffs + 1)
+    # A sequence is never longer than the longest streak of responses in range (the last diff is never used).
+    longestStreak = 0
+    streak = 0
+    for j in range(0, numberDiffs):
+        diff = possibleDiff[j]
+        if (diff == -1):
+            sumDiff[j + 1] = sumDiff[j]
+            sumSqDiff[j + 1] = sumSqDiff[j]
+            sumMissing[j + 1] = sumMissing[j] + 1
+            streak = 0
+        else:
+            sumDiff[j + 1] = sumDiff[j] + diff
+            sumSqDiff[j + 1] = sumSqDiff[j] + diff * diff
+            sumMissing[j + 1] = sumMissing[j]
+            streak += 1
+        if (j < numberDiffs - 1 and streak > longestStreak):
+            longestStreak = streak
+
     # Iterate over all diffs
     bestSequence = -1
-    for currSequence in range(minSequence,minSequence+10):
+    for currSequence in range(minSequence,min(minSequence+10, longestStreak+1)):
         isMade = False
-        for i in range(0, len(possibleDiff) - currSequence):
+        for i in range(0, numberDiffs - currSequence):
             sdA = 0
             sdB = 0
-            # Create a possible sequence of diffs.
-            arrDiff = possibleDiff[i:currSequence + i]
             # Skip the responses not in range.
-            if (-1 in arrDiff):
+            if (sumMissing[currSequence + i] != sumMissing[i]):
                 continue
 
             # Do we apply Jenks optimization method?
             if (useJenks):
-                sdA, sdB = applyJenks(arrDiff)
+                sdA, sdB = applyJenks(possibleDiff[i:currSequence + i])
             else:
-                sdA = calcSD(arrDiff)
+                sdA = calcRunningSD(sumDiff[currSequence + i] - sumDiff[i], sumSqDiff[currSequence + i] - sumSqDiff[i],
+                                    possibleDiff, i, currSequence)
 
             # Make sure the standard deviation is smaller then H_{resp} and H_{req}.
             if (sdA < maxSD and sdB < maxSD):
@@ -274,17 +414,18 @@ def calculateDiffs(responses,images,useJenks):
         if (isMade):
             bestSequence = currSequence
         else:
-            if (bestSequence != -1):
-                isMade = True
             break
 
-    return isMade,bestSequence
+    return (bestSequence != -1),bestSequence
 
 
 def handleSingleQuery(responses,images,useJenks):
     # Calculate diffs for unordered sequence.
     if (useImageOrder):
-        isMade,bestSeq = calculateOrdered(responses, images, useJenks)
+        if (matchingEngine == "numpy"):
+            isMade,bestSeq = calculateOrderedNumpy(responses, images, useJenks)
+        else:
+            isMade,bestSeq = calculateOrdered(responses, images, useJenks)
     else:
         # Calculate for ordered sequence.
         isMade,bestSeq = calculateDiffs(responses,images,useJenks)
@@ -292,6 +433,183 @@ def handleSingleQuery(responses,images,useJenks):
     return isMade,bestSeq
 
 
+# Score the responses of a trace against the ordered images of the candidate fingerprints, batched into one
+# difference matrix per 'IDENTIFY_BATCH' elements. Returns [v, bestSeq, sd] of each fingerprint with a sequence (the same
+# sequences as calculateOrderedNumpy), where sd is the lowest standard deviation of its sequences.
+def scoreOrdered(respLen, candidates):
+    numberRespSeq = len(respLen) - minSequence
+    if (numberRespSeq <= 0):
+        return []
+    scores = []
+    c = 0
+    while (c < len(candidates)):
+        # Take as many fingerprints as fit in the batch (at least one).
+        batch = []
+        numberImages = 0
+        while (c < len(candidates)):
+            v = candidates[c]
+            length = candidateIndex.imageOffsets[v + 1] - candidateIndex.imageOffsets[v]
+            if (len(batch) > 0 and len(respLen) * (numberImages + length) * minSequence > IDENTIFY_BATCH):
+                break
+            batch.append(v)
+            numberImages += length
+            c += 1
+
+        # Sequences of a fingerprint start at p < len(images)-minSequence, so they never cross to the next one.
+        starts = []
+        isStart = np.zeros(numberImages, dtype=bool)
+        allImages = []
+        for v in batch:
+            first = candidateIndex.imageOffsets[v]
+            length = candidateIndex.imageOffsets[v + 1] - first
+            start = 0 if len(starts) == 0 else starts[-1] + len(allImages[-1])
+            starts.append(start)
+            isStart[start:start + max(0, length - minSequence)] = True
+            allImages.append(candidateIndex.images[first:first + length])
+        if (numberImages < minSequence):
+            continue
+
+        diffMatrix = respLen[:, None] - np.concatenate(allImages)[None, :] - headerGuess
+        rowStride, colStride = diffMatrix.strides
+        diffWindows = np.lib.stride_tricks.as_strided(diffMatrix, shape=(numberRespSeq, numberImages - minSequence + 1, minSequence),
+                                                      strides=(rowStride, colStride, rowStride + colStride), writeable=False)
+        inRange = np.all(diffWindows < rangeHeaderGuess, axis=2) & isStart[None, :numberImages - minSequence + 1]
+        allSD = diffWindows.std(axis=2)
+        isValid = inRange & (allSD < maxSD)
+        isBorder = inRange & (np.abs(allSD - maxSD) <= SD_TOLERANCE * max(1.0, maxSD))
+        for i, p in np.argwhere(isBorder):
+            isValid[i, p] = calcSD(diffWindows[i, p].tolist()) < maxSD
+
+        # Lowest standard deviation of each fingerprint over all of its valid sequences.
+        lowestSD = np.full(numberImages, np.inf)
+        lowestSD[:numberImages - minSequence + 1] = np.where(isValid, allSD, np.inf).min(axis=0)
+        lowestSD = np.minimum.reduceat(lowestSD, starts)
+        for b in np.nonzero(lowestSD < np.inf)[0].tolist():
+            scores.append([batch[b], minSequence + 9, float(lowestSD[b])])
+    return scores
+
+
+# Score the responses of a trace against the candidate fingerprints for unordered sequences, for all of them at once.
+# Returns [v, bestSeq, sd] of each fingerprint with a sequence (the same bestSeq as calculateDiffs), where sd is the lowest
+# standard deviation of its sequences of length bestSeq.
+def scoreUnordered(respLen, candidates):
+    numberDiffs = len(respLen)
+    numberCandidates = len(candidates)
+    column = np.full(candidateIndex.numberFingerprints, -1, dtype=np.int64)
+    column[candidates] = np.arange(0, numberCandidates)
+
+    # All (response, image) pairs in range, from the images sorted by size.
+    lowIndex = np.searchsorted(candidateIndex.sizes, respLen - headerGuess - rangeHeaderGuess, side="right")
+    highIndex = np.maximum(np.searchsorted(candidateIndex.sizes, respLen - headerGuess, side="left"), lowIndex)
+    numberPairs = highIndex - lowIndex
+    pairResp = np.repeat(np.arange(0, numberDiffs), numberPairs)
+    pairImage = np.arange(0, int(numberPairs.sum())) - np.repeat(np.cumsum(numberPairs) - numberPairs - lowIndex, numberPairs)
+    pairColumn = column[candidateIndex.owners[pairImage]]
+    isCandidate = (pairColumn != -1)
+    pairResp = pairResp[isCandidate]
+    pairColumn = pairColumn[isCandidate]
+    pairDiff = respLen[pairResp] - headerGuess - candidateIndex.sizes[pairImage[isCandidate]]
+    if (len(pairResp) == 0):
+        return []
+
+    # The 2 smallest diffs of each response and fingerprint (lowDiff and lowSecDiff of calculateDiffs), -1 if there are none.
+    order = np.lexsort((pairDiff, pairColumn, pairResp))
+    pairKey = (pairResp * numberCandidates + pairColumn)[order]
+    pairDiff = pairDiff[order]
+    lowDiff = np.full(numberDiffs * numberCandidates, -1, dtype=np.int64)
+    lowSecDiff = np.full(numberDiffs * numberCandidates, -1, dtype=np.int64)
+    first = np.nonzero(np.r_[True, pairKey[1:] != pairKey[:-1]])[0]
+    lowDiff[pairKey[first]] = pairDiff[first]
+    second = first[first + 1 < len(pairKey)]
+    second = second[pairKey[second + 1] == pairKey[second]]
+    lowSecDiff[pairKey[second]] = pairDiff[second + 1]
+    lowDiff = lowDiff.reshape(numberDiffs, numberCandidates)
+    lowSecDiff = lowSecDiff.reshape(numberDiffs, numberCandidates)
+
+    # Choose the diff that is the closest to the previous one, for all fingerprints at once.
+    possibleDiff = np.empty((numberDiffs, numberCandidates), dtype=np.int64)
+    for j in range(0, numberDiffs):
+        if (j == 0):
+            possibleDiff[j] = lowDiff[j]
+        else:
+            isLow = (np.abs(possibleDiff[j - 1] - lowDiff[j]) < np.abs(possibleDiff[j - 1] - lowSecDiff[j])) | (lowSecDiff[j] == -1)
+            possibleDiff[j] = np.where(isLow, lowDiff[j], lowSecDiff[j])
+
+    # Running sums over the diffs, as in calculateDiffs. The sequence length grows as long as a sequence is made.
+    isMissing = (possibleDiff == -1)
+    inRangeDiff = np.where(isMissing, 0, possibleDiff)
+    zeroRow = np.zeros((1, numberCandidates), dtype=np.int64)
+    sumDiff = np.concatenate((zeroRow, np.cumsum(inRangeDiff, axis=0)))
+    sumSqDiff = np.concatenate((zeroRow, np.cumsum(inRangeDiff * inRangeDiff, axis=0)))
+    sumMissing = np.concatenate((zeroRow, np.cumsum(isMissing, axis=0)))
+    bestSequence = np.full(numberCandidates, -1, dtype=np.int64)
+    bestSD = np.full(numberCandidates, np.inf)
+    isGrowing = np.ones(numberCandidates, dtype=bool)
+    for currSequence in range(minSequence, minSequence + 10):
+        numberSeq = numberDiffs - currSequence
+        if (numberSeq <= 0):
+            break
+        total = sumDiff[currSequence:numberDiffs] - sumDiff[0:numberSeq]
+        totalSq = sumSqDiff[currSequence:numberDiffs] - sumSqDiff[0:numberSeq]
+        inRange = (sumMissing[currSequence:numberDiffs] == sumMissing[0:numberSeq]) & isGrowing[None, :]
+        allSD = np.sqrt(np.maximum(currSequence * totalSq - total * total, 0)) / currSequence
+        isValid = inRange & (allSD < maxSD)
+        isBorder = inRange & (np.abs(allSD - maxSD) <= SD_TOLERANCE * max(1.0, maxSD))
+        for i, c in np.argwhere(isBorder):
+            isValid[i, c] = calcSD(possibleDiff[i:i + currSequence, c].tolist()) < maxSD
+        isMade = isValid.any(axis=0)
+        isGrowing &= isMade
+        if (not isGrowing.any()):
+            break
+        bestSequence[isGrowing] = currSequence
+        bestSD[isGrowing] = np.where(isValid, allSD, np.inf).min(axis=0)[isGrowing]
+
+    return [[candidates[c], int(bestSequence[c]), float(bestSD[c])] for c in np.nonzero(bestSequence != -1)[0].tolist()]
+
+
+# Score the responses of a trace against all fingerprints in one batched pass, instead of one handleSingleQuery per
+# fingerprint. Returns the 'top' fingerprints that reach a sequence as [v, bestSeq, sd], ranked on the longest sequence
+# and then on the lowest standard deviation. Each isMade and bestSeq is the same as that of handleSingleQuery.
+# Jenks can not be batched, so each candidate is then checked with handleSingleQuery and sd is None.
+def identify(responses, top):
+    if (useCandidateIndex):
+        candidates = candidateIndex.getCandidates(responses, headerGuess, rangeHeaderGuess, minSequence, useImageOrder)
+    else:
+        candidates = [v for v in range(0, len(allImageLen)) if len(allImageLen[v]) > 0]
+    if (len(responses) == 0 or len(candidates) == 0):
+        return []
+
+    if (doingJenks):
+        scores = []
+        for v in candidates:
+            isMade, bestSeq = handleSingleQuery(responses, allImageLen[v], True)
+            if (isMade):
+                scores.append([v, bestSeq, None])
+        scores.sort(key=lambda score: (-score[1], score[0]))
+    else:
+        respLen = np.asarray(responses, dtype=np.int64)
+        if (useImageOrder):
+            scores = scoreOrdered(respLen, candidates)
+        else:
+            scores = scoreUnordered(respLen, candidates)
+        scores.sort(key=lambda score: (-score[1], score[2], score[0]))
+    return scores[:top]
+
+
+# Fingerprints of the fingerprint store for each profile index of 'queriesPath', or None if no store is used.
+def loadStoredFingerprints():
+    if (fingerprintStore == ""):
+        return None
+    if (not os.path.isfile(rootDir + fingerprintStore)):
+        print("Error: Fingerprint store '" + fingerprintStore + "' does not exist.")
+        exit(1)
+    allQueries = FingerprintStore.readQueries(rootDir + queriesPath)[:numberAccounts]
+    store = FingerprintStore.FingerprintStore(rootDir + fingerprintStore)
+    allFingerprints = store.loadProfiles(allQueries)
+    store.close()
+    return [allFingerprints.get(allQueries[accounts]) if accounts < len(allQueries) else None for accounts in range(0, numberAccounts)]
+
+
 def loadTraces():
     allImageLen = []
     allRespLen = []
@@ -299,58 +617,166 @@ def loadTraces():
     allQueries = queriesFile.readlines()
     queriesFile.close()
 
+    # Use the compiled trace cache (see TraceCache.py), unless the dataset has changed since.
+    traceCache = TraceCache.openCache(rootDir + datasetPath)
+    if (traceCache is None):
+        print("No valid trace cache for '" + datasetPath + "'. Parsing all traces ...")
+    storedFingerprints = loadStoredFingerprints()
+
     # Load all samples
     global testje
     for accounts in range(0, numberAccounts):
         for iter in range(0, numberIterations):
-            try:
-                fPath = rootDir + datasetPath + repr(accounts) + "_" + repr(iter) + ".txt"
-                traceData = open(fPath, "r")
-            except:
+            if (traceCache is not None):
+                traceIndex = traceCache.findTrace(accounts, iter)
+                if (traceIndex == -1):
+                    allImageLen.append([])
+                    allRespLen.append([])
+                    continue
+                imagesLen = traceCache.getImageSizes(traceIndex)
+                if (storedFingerprints is not None):
+                    imagesLen = FingerprintStore.findFingerprint(storedFingerprints[accounts], iter)
+                if (len(imagesLen) < numberImages):
+                    print("Profile " + repr(accounts) + " has not enough images.")
+                    allImageLen.append([])
+                    allRespLen.append([])
+                    continue
+                allRespLen.append(getRespColumns(traceCache.getConnections(traceIndex)))
+                allImageLen.append(imagesLen)
+                continue
+
+            fPath = TraceFormat.getTracePath(rootDir + datasetPath, accounts, iter)
+            if (fPath is None):
                 allImageLen.append([])
                 allRespLen.append([])
                 continue
 
-            traceDataLines = traceData.readlines()
-            traceData.close()
+            # A binary trace (see TraceFormat.py) is read at once.
+            if (TraceFormat.isBinaryTrace(fPath)):
+                imagesLen, connections = TraceFormat.readTraceFile(fPath)
+                if (storedFingerprints is not None):
+                    imagesLen = FingerprintStore.findFingerprint(storedFingerprints[accounts], iter)
+                if (len(imagesLen) < numberImages):
+                    print("Profile " + repr(accounts) + " has not enough images.")
+                    allImageLen.append([])
+                    allRespLen.append([])
+                    continue
+                allRespLen.append(getRespColumns([connection.getArrays() for connection in connections]))
+                allImageLen.append(imagesLen)
+                continue
 
-            # Get all the responses from this trace.
-            allRespLen.append(getResp(traceDataLines[1:]))
-            # Header line with all the image lengths
-            headerLine = traceDataLines[0]
+            traceData = open(fPath, "r")
 
+            # Header line with all the image lengths
+            headerLine = traceData.readline()
             imagesLen = headerLine[6:].split(' ')
+            if (storedFingerprints is not None):
+                imagesLen = FingerprintStore.findFingerprint(storedFingerprints[accounts], iter)
             if (len(imagesLen) < numberImages):
-                print("Profile " + accounts + " has not enough images.")
+                print("Profile " + repr(accounts) + " has not enough images.")
+                traceData.close()
                 allImageLen.append([])
                 allRespLen.append([])
                 continue
+            # Get all the responses from this trace, while reading the rest of the file.
+            allRespLen.append(getResp(traceData))
+            traceData.close()
             # Bugfix last element
-            imagesLen[len(imagesLen) - 1] = imagesLen[len(imagesLen) - 1][:-3]
+            if (storedFingerprints is None):
+                imagesLen[len(imagesLen) - 1] = imagesLen[len(imagesLen) - 1][:-3]
             # for k in imagesLen:
             #     testje.append(int(k))
             allImageLen.append(imagesLen)
 
-    return allRespLen, allImageLen, allQueries
+    # Index over the image sizes of all fingerprints, used by identify (and to prune the precision phase).
+    candidateIndex = CandidateIndex(allImageLen)
 
+    return allRespLen, allImageLen, allQueries, candidateIndex
 
 
-def runNormalMode():
-    # Load all the traces in the dataset folder.
-    allRespLen, allImageLen, allQueries = loadTraces()
-    sensPred = 0
-    # For each profile and its responses.
-    emptyPreds = 0
+
+# Check the original images of each profile to the sample TLS records from the same profile.
+# Returns [k, isOk] for each sample (isOk is None if the profile has no images) and the best sequence of each sample.
+def evaluateSensitivity():
+    results = []
     allBestSeq = []
     for k in range(0,len(allRespLen)):
         if (len(allImageLen[k]) == 0):
-            emptyPreds += 1
+            results.append([k, None])
             allBestSeq.append(-1)
             continue
-        # Check the original images of the profile to the sample TLS records from the same profile.
         isOk,bestSeq = handleSingleQuery(allRespLen[k], allImageLen[k], doingJenks)
+        results.append([k, isOk])
         allBestSeq.append(bestSeq)
-        if (isOk):
+    return results, allBestSeq
+
+
+# Check the sample TLS records of the samples in [start, end) with the images/fingerprints of all the other profiles.
+# Returns [k, wrongPreds] for each sample, wrongPreds is None if the sample has no responses.
+def evaluatePrecision(start, end):
+    results = []
+    for k in range(start, end):
+        if (len(allRespLen[k]) == 0):
+            results.append([k, None])
+            continue
+        wrongPreds = 0
+        # Check sample TLS records of this profile with the images/fingerprints of all the other profiles at once.
+        # Only fingerprints with a sequence are returned, the others never give a wrong prediction.
+        for v, bestSeq, sd in identify(allRespLen[k], len(allImageLen)):
+            # We skip the own samples, already have that one.
+            if v == k:
+                continue
+            if (allBestSeq[k] > 0 and allBestSeq[k] < bestSeq):
+                wrongPreds += 1
+        results.append([k, wrongPreds])
+
+    if (partialResultsPath != ""):
+        partialFile = open(rootDir + partialResultsPath + "precision_" + repr(start) + "_" + repr(end) + ".json", "w")
+        partialFile.write(json.dumps({"start": start, "end": end, "results": results}))
+        partialFile.close()
+    return results
+
+
+def evaluatePrecisionTask(task):
+    return evaluatePrecision(task[0], task[1])
+
+
+# Yield [k, wrongPreds] of each sample in [start, end) (see evaluatePrecision), with 'numberWorkers' processes.
+def iterPrecision(start, end):
+    if (partialResultsPath != ""):
+        os.makedirs(rootDir + partialResultsPath, exist_ok=True)
+
+    # The [start, end) range is split up in tasks of 'profilesPerTask' samples.
+    tasks = [[s, min(s + profilesPerTask, end)] for s in range(start, end, profilesPerTask)]
+    pool = None
+    if (numberWorkers > 1):
+        pool = multiprocessing.get_context("fork").Pool(numberWorkers)
+        allResults = pool.imap(evaluatePrecisionTask, tasks)
+    else:
+        allResults = map(evaluatePrecisionTask, tasks)
+
+    # Results are handled in the order of the tasks, regardless of which worker finishes first.
+    for results in allResults:
+        yield from results
+
+    if (pool is not None):
+        pool.close()
+        pool.join()
+
+
+def runNormalMode():
+    # The traces are global, so worker processes inherit them when forked instead of receiving them with each task.
+    global allRespLen, allImageLen, allBestSeq, candidateIndex
+    # Load all the traces in the dataset folder.
+    allRespLen, allImageLen, allQueries, candidateIndex = loadTraces()
+    sensPred = 0
+    # For each profile and its responses.
+    emptyPreds = 0
+    results, allBestSeq = evaluateSensitivity()
+    for k, isOk in results:
+        if (isOk is None):
+            emptyPreds += 1
+        elif (isOk):
             print("Prediction for profile " + str(k) + " is ok!")
             sensPred += 1
         else:
@@ -365,32 +791,146 @@ def runNormalMode():
     if (endProfile == -1):
         endProfile = len(allRespLen)
     else:
-        endProfile - min(len(allRespLen),endProfile)
+        endProfile = min(len(allRespLen),endProfile)
 
-    for k in range(startProfile,endProfile):
-        if (len(allRespLen[k]) == 0):
+    for k, wrongPreds in iterPrecision(startProfile, endProfile):
+        if (wrongPreds is None):
             emptyPreds += 1
             continue
-        wrongPreds = 0
-        for v in range(0,len(allImageLen)):
-            # We skip the own samples, already have that one.
-            if v == k:
-                continue
-            # Check sample TLS records of this profile, with the images/fingerprints of all the other profiles.
-            isWrongPred, bestSeq = handleSingleQuery(allRespLen[k], allImageLen[v], doingJenks)
-            if (allBestSeq[k] > 0 and allBestSeq[k] < bestSeq and isWrongPred):
-                wrongPreds += 1
-            # if (isWrongPred):
-            #     wrongPreds += 1
         if (wrongPreds == 0):
             totalCorrect += 1
         print("Profile " + str(k) + " has " + str(wrongPreds) + " wrong predictions.")
 
-
     print("Precision " + str((totalCorrect/(len(allRespLen)-emptyPreds))*100) + " %")
 
+    if (rankingOutput != ""):
+        writeRankings(allQueries, startProfile, endProfile)
 
 
+# Write the ranked fingerprints of the samples in [start, end) to 'rankingOutput', one row per sample and rank.
+# Together with the profile of each sample, this gives the confusion matrix of the top ranked profiles.
+def writeRankings(allQueries, start, end):
+    rankingFile = open(rootDir + rankingOutput, "w")
+    rankingFile.write("sample,profile,name,rank,predictedProfile,predictedName,sequence,sd\n")
+    for k in range(start, end):
+        profile = k // numberIterations
+        for rank, (v, bestSeq, sd) in enumerate(identify(allRespLen[k], rankingTop)):
+            predictedProfile = v // numberIterations
+            rankingFile.write(",".join(str(value) for value in [k, profile, allQueries[profile].strip(), rank + 1, predictedProfile,
+                                                                allQueries[predictedProfile].strip(), bestSeq, "" if sd is None else round(sd, 3)]) + "\n")
+    rankingFile.close()
+    print("Rankings written to " + rankingOutput)
 
-runNormalMode()
 
+
+# Load the connections and images of all traces once. The connections of a trace are None if it has no (valid) trace.
+def loadTraceColumns():
+    allConnections = []
+    allImageLen = []
+    traceCache = TraceCache.openCache(rootDir + datasetPath)
+    if (traceCache is None):
+        print("No valid trace cache for '" + datasetPath + "'. Parsing all traces ...")
+    storedFingerprints = loadStoredFingerprints()
+
+    for accounts in range(0, numberAccounts):
+        for iter in range(0, numberIterations):
+            if (traceCache is not None):
+                traceIndex = traceCache.findTrace(accounts, iter)
+                if (traceIndex == -1):
+                    imagesLen = []
+                else:
+                    imagesLen = traceCache.getImageSizes(traceIndex)
+                    connections = list(traceCache.getConnections(traceIndex))
+            else:
+                fPath = TraceFormat.getTracePath(rootDir + datasetPath, accounts, iter)
+                if (fPath is None):
+                    imagesLen = []
+                else:
+                    imagesLen, traceConnections = TraceFormat.readTraceFile(fPath)
+                    connections = [connection.getArrays() for connection in traceConnections]
+            if (storedFingerprints is not None and imagesLen != []):
+                imagesLen = FingerprintStore.findFingerprint(storedFingerprints[accounts], iter)
+
+            if (len(imagesLen) < numberImages):
+                allImageLen.append([])
+                allConnections.append(None)
+            else:
+                allImageLen.append(imagesLen)
+                allConnections.append(connections)
+    return allConnections, allImageLen
+
+
+# Evaluate all combinations of the parameters in 'sweep' on traces that are only parsed once. The responses of the
+# traces are extracted once for each combination of the response parameters (see RESPONSE_PARAMETERS).
+def runSweepMode():
+    global allRespLen, allImageLen, allBestSeq, candidateIndex
+    allConnections, allImageLen = loadTraceColumns()
+    candidateIndex = CandidateIndex(allImageLen)
+
+    # Combinations with the same response parameters follow each other.
+    parameterNames = sorted(sweepGrid, key=lambda name: name not in RESPONSE_PARAMETERS)
+    allPoints = list(itertools.product(*[sweepGrid[name] for name in parameterNames]))
+    print("Sweeping " + repr(len(allPoints)) + " combinations of " + ", ".join(parameterNames) + " ...")
+
+    global endProfile
+    allResponses = {}
+    allRows = []
+    for point in allPoints:
+        startTime = time.time()
+        for name, value in zip(parameterNames, point):
+            globalName, convert = SWEEP_PARAMETERS[name]
+            globals()[globalName] = convert(value)
+
+        responseKey = (noiseFrameSize, minDataSize, usingHTTP2, caching)
+        if (responseKey not in allResponses):
+            allResponses[responseKey] = [getRespColumns(conns) if conns is not None else [] for conns in allConnections]
+        allRespLen = allResponses[responseKey]
+
+        results, allBestSeq = evaluateSensitivity()
+        sensPred = sum(1 for k, isOk in results if isOk)
+        emptyPreds = sum(1 for k, isOk in results if isOk is None)
+        sensitivity = (sensPred/(len(allRespLen)-emptyPreds))*100
+
+        end = len(allRespLen) if endProfile == -1 else min(len(allRespLen), endProfile)
+        totalCorrect = 0
+        emptyPreds = 0
+        for k, wrongPreds in iterPrecision(startProfile, end):
+            if (wrongPreds is None):
+                emptyPreds += 1
+            elif (wrongPreds == 0):
+                totalCorrect += 1
+        precision = (totalCorrect/(len(allRespLen)-emptyPreds))*100
+
+        allRows.append(list(point) + [sensitivity, precision, time.time() - startTime])
+        print(", ".join(name + "=" + str(value) for name, value in zip(parameterNames, point)) + ": Sensitivity " + str(sensitivity) + " %, Precision " + str(precision) + " %")
+
+    resultsFile = open(rootDir + sweepOutput, "w")
+    resultsFile.write(",".join(parameterNames + ["sensitivity", "precision", "seconds"]) + "\n")
+    for row in allRows:
+        resultsFile.write(",".join(str(value) for value in row) + "\n")
+    resultsFile.close()
+    print("Results of the sweep written to " + sweepOutput)
+
+
+# Only the stages of the main process are measured, so use 'numberWorkers' 1 to include the precision phase.
+if (useInstrumentation):
+    TraceCache.openCache = Instrumentation.instrument(TraceCache.openCache, "openCache")
+    getResp = Instrumentation.instrument(getResp, "getResp")
+    getRespColumns = Instrumentation.instrument(getRespColumns, "getRespColumns")
+    calcSD = Instrumentation.instrument(calcSD, "calcSD")
+    applyJenks = Instrumentation.instrument(applyJenks, "applyJenks")
+    calculateOrdered = Instrumentation.instrument(calculateOrdered, "calculateOrdered")
+    calculateOrderedNumpy = Instrumentation.instrument(calculateOrderedNumpy, "calculateOrderedNumpy")
+    calculateDiffs = Instrumentation.instrument(calculateDiffs, "calculateDiffs")
+    handleSingleQuery = Instrumentation.instrument(handleSingleQuery, "handleSingleQuery", True)
+    CandidateIndex.getCandidates = Instrumentation.instrument(CandidateIndex.getCandidates, "getCandidates")
+    loadTraces = Instrumentation.instrument(loadTraces, "loadTraces")
+    evaluateSensitivity = Instrumentation.instrument(evaluateSensitivity, "evaluateSensitivity")
+    evaluatePrecision = Instrumentation.instrument(evaluatePrecision, "evaluatePrecision")
+    identify = Instrumentation.instrument(identify, "identify", True)
+
+
+if __name__ == "__main__":
+    Instrumentation.runProfiled(runSweepMode if len(sweepGrid) > 0 else runNormalMode, profiler, rootDir + profileOutput)
+    if (useInstrumentation):
+        Instrumentation.printReport()
@@ -0,0 +1,138 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Opt-in instrumentation of ImprovedIUPTIS_PERFORM.py: wall time and number of calls per stage, latency histograms
+# and profiles (cProfile/pstats or collapsed stacks for flamegraph.pl). Functions are only wrapped when the
+# instrumentation is enabled, so there is no overhead at all when it is disabled.
+
+import sys
+import time
+import threading
+import collections
+import cProfile
+
+
+# Wall time and number of calls of each stage, and a histogram of the latencies of some stages.
+allStages = collections.OrderedDict()
+allHistograms = {}
+
+
+# Wrap a function so each call is counted and timed as the stage 'name'. With 'useHistogram', the latency of each
+# call is also added to a histogram with power-of-two buckets (in microseconds).
+def instrument(function, name, useHistogram=False):
+    stage = allStages.setdefault(name, [0, 0.0])
+    histogram = allHistograms.setdefault(name, collections.Counter()) if useHistogram else None
+
+    def timedFunction(*args, **kwargs):
+        startTime = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - startTime
+            stage[0] += 1
+            stage[1] += seconds
+            if (histogram is not None):
+                histogram[int(seconds * 1000000).bit_length()] += 1
+    return timedFunction
+
+
+# Nested stages are included in the time of their parents.
+def printReport():
+    print("Stage                          Calls     Total (s)   Mean (us)")
+    for name, (calls, seconds) in allStages.items():
+        meanTime = (seconds / calls) * 1000000 if calls > 0 else 0
+        print("%-30s %-9d %-11.3f %.1f" % (name, calls, seconds, meanTime))
+    for name, histogram in allHistograms.items():
+        print("Latency histogram of " + name + ":")
+        for bucket in sorted(histogram):
+            upperBound = 2 ** bucket
+            print("  < %-10d us: %d" % (upperBound, histogram[bucket]))
+
+
+# Samples the stack of a thread at a fixed interval and counts each stack as in the collapsed-stack format
+# ('function;function;function count'), which is the input of flamegraph.pl.
+class StackSampler(object):
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.allStacks = collections.Counter()
+        self.isRunning = False
+
+    def start(self):
+        self.threadId = threading.get_ident()
+        self.isRunning = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.isRunning = False
+        self.thread.join()
+
+    def run(self):
+        while (self.isRunning):
+            frame = sys._current_frames().get(self.threadId)
+            stack = []
+            while (frame is not None):
+                code = frame.f_code
+                stack.append(code.co_name + " (" + code.co_filename.split("/")[-1] + ":" + str(code.co_firstlineno) + ")")
+                frame = frame.f_back
+            if (len(stack) > 0):
+                self.allStacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def dump(self, fileName):
+        f = open(fileName, "w")
+        for stack, count in self.allStacks.most_common():
+            f.write(stack + " " + str(count) + "\n")
+        f.close()
+
+
+# Run a function under the given profiler ("none", "cprofile" or "stacks") and write the profile to 'outputName'
+# ('<outputName>.pstats' or '<outputName>.collapsed').
+def runProfiled(function, profiler, outputName):
+    if (profiler == "cprofile"):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function()
+        finally:
+            profile.disable()
+            profile.dump_stats(outputName + ".pstats")
+            print("Profile written to " + outputName + ".pstats")
+    elif (profiler == "stacks"):
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            return function()
+        finally:
+            sampler.stop()
+            sampler.dump(outputName + ".collapsed")
+            print("Collapsed stacks written to " + outputName + ".collapsed")
+    return function()
@@ -0,0 +1,282 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Online identification of the profile that is being browsed, fed by tcpproxy.py with each TLS record as it is proxied.
+# The HTTP responses are extracted incrementally per connection (like getResp in ImprovedIUPTIS_PERFORM.py), and each
+# finished response is matched right away against an in-memory index of the images of all fingerprints (like
+# calculateDiffs, without Jenks). The parameters and fingerprints are taken from a PERFORM config file.
+# The proxy only puts each record on a queue, the matching and ranking run on a separate classifier thread.
+
+import os
+import json
+import time
+import collections
+import threading
+import queue
+import numpy as np
+import TraceCache
+import TraceFormat
+import FingerprintStore
+from SequenceStats import calcSD
+
+
+# Incremental version of iterResp for one TCP connection.
+class ResponseTracker(object):
+    def __init__(self, noiseFrameSize, minDataSize, usingHTTP2):
+        self.noiseFrameSize = noiseFrameSize
+        self.minDataSize = minDataSize
+        self.usingHTTP2 = usingHTTP2
+        self.inPlus = False
+        self.totalResp = 0
+
+    # Returns the length of the response that is finished by this record, or None.
+    def addRecord(self, sslLen, sslDirection):
+        if (sslDirection < 0):
+            if (sslLen >= self.noiseFrameSize or not self.usingHTTP2):
+                if (self.inPlus):
+                    self.totalResp += sslLen
+                else:
+                    self.totalResp = sslLen
+                    self.inPlus = True
+        elif (self.inPlus):
+            # Make sure we skip other small resources such as stylesheets or javascript files.
+            return self.finish()
+        return None
+
+    # The connection is closed, returns the length of its last response or None.
+    def finish(self):
+        totalResp = self.totalResp
+        self.totalResp = 0
+        self.inPlus = False
+        if (totalResp > self.minDataSize):
+            return totalResp
+        return None
+
+
+# State of one fingerprint: the diffs of the current streak of responses in range and the best sequence so far.
+class FingerprintState(object):
+    __slots__ = ["lastResponse", "diffs", "bestSequence", "bestSD"]
+
+    def __init__(self, maxSequence):
+        self.lastResponse = -1
+        self.diffs = collections.deque(maxlen=maxSequence)
+        self.bestSequence = -1
+        self.bestSD = 0.0
+
+
+# Events on the queue of the classifier thread.
+EVENT_RECORD = 0
+EVENT_CLOSE = 1
+EVENT_RESET = 2
+EVENT_RANKING = 3
+
+
+class LiveClassifier(object):
+    def __init__(self, configName):
+        configFile = open(configName, "r")
+        configParameters = json.loads(configFile.read())
+        configFile.close()
+        self.headerGuess = configParameters["b_in"]
+        self.rangeHeaderGuess = configParameters["pi_resp"]
+        self.minSequence = configParameters["sequence"]
+        self.maxSD = configParameters["maxSD"]
+        self.noiseFrameSize = configParameters["minFrame"]
+        self.minDataSize = configParameters["minDataSize"]
+        self.usingHTTP2 = (configParameters["usingHTTP2"] == "True")
+        rootDir = os.getcwd() + "/"
+
+        fingerprintStore = configParameters.get("fingerprintStore", "")
+        if (fingerprintStore != ""):
+            self.loadFingerprintStore(rootDir + fingerprintStore, configParameters["numberImages"])
+        else:
+            queriesFile = open(rootDir + configParameters["queriesPath"])
+            self.allQueries = [q.strip() for q in queriesFile.readlines()]
+            queriesFile.close()
+            self.loadFingerprints(rootDir + configParameters["datasetPath"], configParameters["numberProfiles"],
+                                  configParameters["numberIterations"], configParameters["numberImages"])
+
+        # Events of the proxy, handled in order by the classifier thread, which is the only one that touches the state below.
+        self.events = queue.Queue()
+        self.allTrackers = {}
+        self.allStates = {}
+        self.numberResponses = 0
+        threading.Thread(target=self.run, daemon=True).start()
+
+    # Index over the image sizes of all samples of all profiles, sorted by size. Each sample is a fingerprint of its profile.
+    def loadFingerprints(self, datasetDir, numberAccounts, numberIterations, numberImages):
+        traceCache = TraceCache.openCache(datasetDir)
+        sizes = []
+        owners = []
+        self.fingerprintProfiles = []
+        for accounts in range(0, numberAccounts):
+            for iter in range(0, numberIterations):
+                imagesLen = []
+                if (traceCache is not None):
+                    traceIndex = traceCache.findTrace(accounts, iter)
+                    if (traceIndex != -1):
+                        imagesLen = traceCache.getImageSizes(traceIndex)
+                elif (TraceFormat.getTracePath(datasetDir, accounts, iter) is not None):
+                    imagesLen = TraceFormat.readTraceImages(TraceFormat.getTracePath(datasetDir, accounts, iter))
+                if (len(imagesLen) < numberImages):
+                    continue
+                sizes.extend(imagesLen)
+                owners.extend([len(self.fingerprintProfiles)] * len(imagesLen))
+                self.fingerprintProfiles.append(accounts)
+
+        order = np.argsort(np.array(sizes, dtype=np.int64), kind="stable")
+        self.sizes = np.array(sizes, dtype=np.int64)[order]
+        self.owners = np.array(owners, dtype=np.int64)[order]
+        print("Live classifier loaded " + repr(len(self.fingerprintProfiles)) + " fingerprints with " + repr(len(sizes)) + " images.")
+
+    # Same index, taken from a fingerprint store (see FingerprintStore.py) with all of its profiles. The profile of a
+    # fingerprint is then the index of its name in the store instead of in the queries file.
+    def loadFingerprintStore(self, storePath, numberImages):
+        if (not os.path.isfile(storePath)):
+            print("Error: Fingerprint store '" + storePath + "' does not exist.")
+            exit(1)
+        store = FingerprintStore.FingerprintStore(storePath)
+        self.allQueries, fingerprintNames, sizes, owners = store.loadSortedIndex(numberImages)
+        store.close()
+        self.fingerprintProfiles = fingerprintNames.tolist()
+        self.sizes = sizes.astype(np.int64)
+        self.owners = owners.astype(np.int64)
+        print("Live classifier loaded " + repr(len(self.fingerprintProfiles)) + " fingerprints with " + repr(len(sizes)) + " images.")
+
+    # Start a new session, for instance when tcpproxy.py clears its records between two profiles.
+    def reset(self):
+        self.events.put((EVENT_RESET,))
+
+    # Called by the proxy for each TLS record, only queues it so the proxied traffic is not delayed by the matching.
+    def addRecord(self, connection, sslLen, sslDirection):
+        self.events.put((EVENT_RECORD, connection, sslLen, sslDirection))
+
+    def closeConnection(self, connection):
+        self.events.put((EVENT_CLOSE, connection))
+
+    # Classifier thread.
+    def run(self):
+        while (True):
+            event = self.events.get()
+            if (event[0] == EVENT_RECORD):
+                connection, sslLen, sslDirection = event[1:]
+                tracker = self.allTrackers.get(connection)
+                if (tracker is None):
+                    tracker = ResponseTracker(self.noiseFrameSize, self.minDataSize, self.usingHTTP2)
+                    self.allTrackers[connection] = tracker
+                response = tracker.addRecord(sslLen, sslDirection)
+                if (response is not None):
+                    self.addResponse(response)
+            elif (event[0] == EVENT_CLOSE):
+                tracker = self.allTrackers.pop(event[1], None)
+                if (tracker is not None):
+                    response = tracker.finish()
+                    if (response is not None):
+                        self.addResponse(response)
+            elif (event[0] == EVENT_RESET):
+                self.allTrackers = {}
+                self.allStates = {}
+                self.numberResponses = 0
+            elif (event[0] == EVENT_RANKING):
+                top, ranking, isDone = event[1:]
+                ranking.extend(self.rankProfiles(top))
+                isDone.set()
+
+    # Match a finished response with the images of all fingerprints that are in range of it.
+    def addResponse(self, response):
+        startTime = time.perf_counter()
+        responseIndex = self.numberResponses
+        self.numberResponses += 1
+        maxSequence = self.minSequence + 9
+
+        # Images with response - headerGuess - rangeHeaderGuess < image < response - headerGuess.
+        low = np.searchsorted(self.sizes, response - self.headerGuess - self.rangeHeaderGuess, side="right")
+        high = np.searchsorted(self.sizes, response - self.headerGuess, side="left")
+        # The 2 smallest diffs of each fingerprint (the sizes are sorted, so the largest images come last).
+        allDiffs = {}
+        for imlen, owner in zip(self.sizes[low:high].tolist()[::-1], self.owners[low:high].tolist()[::-1]):
+            diffs = allDiffs.setdefault(owner, [])
+            if (len(diffs) < 2):
+                diffs.append(response - self.headerGuess - imlen)
+
+        isImproved = False
+        for owner, diffs in allDiffs.items():
+            state = self.allStates.get(owner)
+            if (state is None):
+                state = FingerprintState(maxSequence)
+                self.allStates[owner] = state
+            if (state.lastResponse != responseIndex - 1):
+                state.diffs.clear()
+            # The smallest diff is not always from the correct image, choose the one closest to the previous diff.
+            previousDiff = state.diffs[-1] if len(state.diffs) > 0 else -1
+            if (len(diffs) == 1 or abs(previousDiff - diffs[0]) < abs(previousDiff - diffs[1])):
+                state.diffs.append(diffs[0])
+            else:
+                state.diffs.append(diffs[1])
+            state.lastResponse = responseIndex
+
+            # The longest sequence of the latest diffs (from 'sequence' up) with a standard deviation below maxSD.
+            allLatest = list(state.diffs)
+            for currSequence in range(self.minSequence, len(allLatest) + 1):
+                sd = calcSD(allLatest[-currSequence:])
+                if (sd >= self.maxSD):
+                    break
+                if (currSequence > state.bestSequence):
+                    state.bestSequence = currSequence
+                    state.bestSD = sd
+                    isImproved = True
+
+        if (isImproved):
+            ranking = self.rankProfiles(5)
+            latency = (time.perf_counter() - startTime) * 1000
+            print("Prediction after " + repr(self.numberResponses) + " responses (" + ("%.2f" % latency) + " ms): " +
+                  ", ".join(r["name"] + " (sequence " + repr(r["sequence"]) + ", SD " + ("%.1f" % r["sd"]) + ")" for r in ranking))
+
+    # Profiles with a sequence, ranked on the longest sequence and then on the lowest standard deviation.
+    def rankProfiles(self, top):
+        allProfiles = {}
+        for owner, state in self.allStates.items():
+            if (state.bestSequence == -1):
+                continue
+            profile = self.fingerprintProfiles[owner]
+            score = (state.bestSequence, -state.bestSD)
+            if (profile not in allProfiles or score > allProfiles[profile]):
+                allProfiles[profile] = score
+        ranked = sorted(allProfiles.items(), key=lambda item: item[1], reverse=True)[:top]
+        return [{"profile": profile, "name": self.allQueries[profile] if profile < len(self.allQueries) else repr(profile),
+                 "sequence": score[0], "sd": -score[1]} for profile, score in ranked]
+
+    # Ranking after all records that were queued before this call.
+    def getRanking(self, top=10):
+        ranking = []
+        isDone = threading.Event()
+        self.events.put((EVENT_RANKING, top, ranking, isDone))
+        isDone.wait()
+        return ranking
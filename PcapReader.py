@@ -0,0 +1,393 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Streaming reader of pcap and pcapng captures (for instance of tcpdump). The TCP connections are reassembled
+# and only the 5-byte headers of the TLS records are parsed, the content of the records is skipped.
+# Usage: python PcapReader.py <capture> [<server_port>]
+
+import sys
+import struct
+import HandshakeParser
+
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAPNG_SECTION_HEADER = b"\x0a\x0d\x0d\x0a"
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 101, 228, 229)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# TLS content types 20 (change_cipher_spec) up to 24 (heartbeat).
+TLS_CONTENT_TYPES = range(20, 25)
+TLS_MAX_RECORD_LENGTH = 2**14 + 2048
+# Segments that arrive after a gap are kept until the gap is filled. If there are more than this,
+# the missing data was never captured and we continue at the first segment after the gap.
+MAX_PENDING_SEGMENTS = 256
+SEQ_MASK = 0xffffffff
+
+
+def seqDiff(seq, otherSeq):
+    diff = (seq - otherSeq) & SEQ_MASK
+    if (diff >= 0x80000000):
+        diff -= 0x100000000
+    return diff
+
+
+def readExactly(fileObj, size):
+    data = fileObj.read(size)
+    if (len(data) < size):
+        return None
+    return data
+
+
+# Yield (timestamp, link type, frame) for each packet of a pcap capture.
+def iterPcapPackets(fileObj, fileHeader):
+    byteOrder, resolution = PCAP_MAGIC[fileHeader[:4]]
+    linkType = struct.unpack(byteOrder + "I", fileHeader[20:24])[0] & 0x0fffffff
+    recordHeader = struct.Struct(byteOrder + "IIII")
+    while True:
+        header = readExactly(fileObj, 16)
+        if (header is None):
+            return
+        seconds, fraction, capturedLength, originalLength = recordHeader.unpack(header)
+        frame = readExactly(fileObj, capturedLength)
+        # Brutally killing tcpdump might leave the last packet unfinished.
+        if (frame is None):
+            return
+        yield seconds + fraction * resolution, linkType, frame
+
+
+# Yield (timestamp, link type, frame) for each packet of a pcapng capture.
+def iterPcapngPackets(fileObj, blockStart):
+    byteOrder = "<"
+    interfaces = []
+    while True:
+        blockHeader = blockStart if blockStart is not None else readExactly(fileObj, 8)
+        blockStart = None
+        if (blockHeader is None):
+            return
+        if (blockHeader[:4] == PCAPNG_SECTION_HEADER):
+            # The byte-order magic decides the byte order of the rest of the section.
+            byteOrderMagic = readExactly(fileObj, 4)
+            if (byteOrderMagic is None):
+                return
+            byteOrder = "<" if byteOrderMagic == b"\x4d\x3c\x2b\x1a" else ">"
+            blockLength = struct.unpack(byteOrder + "I", blockHeader[4:8])[0]
+            body = readExactly(fileObj, blockLength - 12)
+            if (body is None):
+                return
+            interfaces = []
+            continue
+
+        blockType, blockLength = struct.unpack(byteOrder + "II", blockHeader)
+        body = readExactly(fileObj, blockLength - 8)
+        if (body is None):
+            return
+
+        if (blockType == 1):
+            # Interface description block: link type and timestamp resolution (option if_tsresol).
+            linkType = struct.unpack_from(byteOrder + "H", body, 0)[0]
+            resolution = 1e-6
+            offset = 8
+            while (offset + 4 <= len(body) - 4):
+                optionCode, optionLength = struct.unpack_from(byteOrder + "HH", body, offset)
+                if (optionCode == 0):
+                    break
+                if (optionCode == 9 and optionLength >= 1):
+                    tsresol = body[offset + 4]
+                    resolution = 2.0 ** -(tsresol & 0x7f) if tsresol & 0x80 else 10.0 ** -tsresol
+                offset += 4 + ((optionLength + 3) & ~3)
+            interfaces.append((linkType, resolution))
+        elif (blockType == 6 or blockType == 2):
+            # Enhanced packet block (or the obsolete packet block).
+            if (blockType == 6):
+                interfaceId, timestampHigh, timestampLow, capturedLength = struct.unpack_from(byteOrder + "IIII", body, 0)
+            else:
+                interfaceId, drops, timestampHigh, timestampLow, capturedLength = struct.unpack_from(byteOrder + "HHIII", body, 0)
+            if (interfaceId >= len(interfaces)):
+                continue
+            linkType, resolution = interfaces[interfaceId]
+            yield ((timestampHigh << 32) | timestampLow) * resolution, linkType, body[20:20 + capturedLength]
+
+
+# Yield (timestamp, link type, frame) for each packet of a pcap or pcapng capture.
+def iterPackets(fileObj):
+    fileHeader = readExactly(fileObj, 8)
+    if (fileHeader is None):
+        return iter(())
+    if (fileHeader[:4] == PCAPNG_SECTION_HEADER):
+        return iterPcapngPackets(fileObj, fileHeader)
+    if (fileHeader[:4] in PCAP_MAGIC):
+        rest = readExactly(fileObj, 16)
+        if (rest is None):
+            return iter(())
+        return iterPcapPackets(fileObj, fileHeader + rest)
+    raise ValueError("Not a pcap or pcapng capture.")
+
+
+# Returns (source address, source port, destination address, destination port, sequence number, flags, payload)
+# of a TCP segment, or None if the frame is not TCP.
+def parseTCP(linkType, frame):
+    if (linkType == LINKTYPE_ETHERNET):
+        offset = 14
+        if (len(frame) < offset):
+            return None
+        etherType = struct.unpack_from(">H", frame, 12)[0]
+        # VLAN tags.
+        while (etherType in (0x8100, 0x88a8) and len(frame) >= offset + 4):
+            etherType = struct.unpack_from(">H", frame, offset + 2)[0]
+            offset += 4
+        if (etherType != 0x0800 and etherType != 0x86dd):
+            return None
+    elif (linkType == LINKTYPE_LINUX_SLL):
+        offset = 16
+    elif (linkType == LINKTYPE_LINUX_SLL2):
+        offset = 20
+    elif (linkType == LINKTYPE_NULL):
+        offset = 4
+    elif (linkType in LINKTYPE_RAW):
+        offset = 0
+    else:
+        return None
+    if (len(frame) < offset + 20):
+        return None
+
+    version = frame[offset] >> 4
+    if (version == 4):
+        headerLength = (frame[offset] & 0x0f) * 4
+        totalLength, fragment, protocol = struct.unpack_from(">H2xHxB", frame, offset + 2)
+        # Fragments are not reassembled, TCP avoids them anyway.
+        if (protocol != 6 or fragment & 0x3fff):
+            return None
+        sourceAddress = frame[offset + 12:offset + 16]
+        destinationAddress = frame[offset + 16:offset + 20]
+        end = offset + totalLength
+        offset += headerLength
+    elif (version == 6):
+        if (len(frame) < offset + 40):
+            return None
+        payloadLength, nextHeader = struct.unpack_from(">HB", frame, offset + 4)
+        sourceAddress = frame[offset + 8:offset + 24]
+        destinationAddress = frame[offset + 24:offset + 40]
+        end = offset + 40 + payloadLength
+        offset += 40
+        # Hop-by-hop, routing and destination options headers.
+        while (nextHeader in (0, 43, 60) and len(frame) >= offset + 8):
+            nextHeader = frame[offset]
+            offset += (frame[offset + 1] + 1) * 8
+        if (nextHeader != 6):
+            return None
+    else:
+        return None
+
+    if (len(frame) < offset + 20):
+        return None
+    sourcePort, destinationPort, seq, dataOffset, flags = struct.unpack_from(">HHI4xBB", frame, offset)
+    # The end of the IP packet removes the Ethernet padding (if the length is not 0 because of TSO).
+    if (end <= offset):
+        end = len(frame)
+    payload = frame[offset + (dataOffset >> 4) * 4:end]
+    return sourceAddress, sourcePort, destinationAddress, destinationPort, seq, flags, payload
+
+
+# One direction of a TCP connection: reassembles the segments and parses the TLS record headers.
+class TLSStream(object):
+    def __init__(self, streamIndex, direction):
+        self.streamIndex = streamIndex
+        self.direction = direction
+        self.reset()
+
+    def reset(self):
+        self.nextSeq = None
+        self.pendingSegments = {}
+        self.header = bytearray()
+        self.remainingRecord = 0
+        self.currentRecord = None
+        # Body of the first handshake record from the client, which is the Client Hello.
+        self.clientHello = None
+        self.handshakeData = None
+        self.targeted = None
+
+    # Returns the (content type, length) of the TLS records that are completed by this segment.
+    def addSegment(self, seq, flags, payload):
+        records = []
+        if (flags & TCP_SYN):
+            self.reset()
+            self.nextSeq = (seq + 1) & SEQ_MASK
+            return records
+        if (len(payload) == 0):
+            return records
+        # The capture started in the middle of the connection.
+        if (self.nextSeq is None):
+            self.nextSeq = seq
+
+        offset = seqDiff(seq, self.nextSeq)
+        if (offset > 0):
+            self.pendingSegments[seq] = payload
+            if (len(self.pendingSegments) <= MAX_PENDING_SEGMENTS):
+                return records
+            # The gap will not be filled anymore. The next header is found again by parsing byte by byte.
+            self.nextSeq = min(self.pendingSegments, key=lambda s: seqDiff(s, self.nextSeq))
+            self.header = bytearray()
+            self.remainingRecord = 0
+        else:
+            # Retransmission (of a part) of data that we already have.
+            if (-offset < len(payload)):
+                self.consume(payload[-offset:], records)
+
+        while (len(self.pendingSegments) > 0):
+            isConsumed = False
+            for pendingSeq in list(self.pendingSegments):
+                offset = seqDiff(pendingSeq, self.nextSeq)
+                if (offset <= 0):
+                    pendingPayload = self.pendingSegments.pop(pendingSeq)
+                    if (-offset < len(pendingPayload)):
+                        self.consume(pendingPayload[-offset:], records)
+                        isConsumed = True
+            if (not isConsumed):
+                break
+        return records
+
+    def consume(self, data, records):
+        self.nextSeq = (self.nextSeq + len(data)) & SEQ_MASK
+        position = 0
+        while (position < len(data)):
+            if (self.remainingRecord > 0):
+                step = min(self.remainingRecord, len(data) - position)
+                if (self.handshakeData is not None):
+                    self.handshakeData += data[position:position + step]
+                self.remainingRecord -= step
+                position += step
+                if (self.remainingRecord == 0):
+                    self.finishRecord(records)
+                continue
+
+            needed = 5 - len(self.header)
+            self.header += data[position:position + needed]
+            position += needed
+            if (len(self.header) < 5):
+                break
+            contentType, majorVersion, minorVersion, length = struct.unpack(">BBBH", self.header)
+            if (contentType in TLS_CONTENT_TYPES and majorVersion == 3 and minorVersion <= 4 and length <= TLS_MAX_RECORD_LENGTH):
+                self.header = bytearray()
+                self.currentRecord = (contentType, length)
+                self.remainingRecord = length
+                if (contentType == 22 and self.direction == 1 and self.clientHello is None):
+                    self.handshakeData = bytearray()
+                if (length == 0):
+                    self.finishRecord(records)
+            else:
+                # Not a TLS record header (for instance the HTTP CONNECT request to the proxy). Move one byte further.
+                del self.header[0]
+
+
+    # Is the server name of the Client Hello the targeted domain? The decision is kept for the rest of the connection.
+    def isTargeted(self, domainName):
+        if (self.targeted is None and self.clientHello is not None):
+            serverName = HandshakeParser.parseServerName(self.clientHello)
+            self.targeted = serverName is not None and HandshakeParser.isTargetedHost(serverName, domainName)
+        return self.targeted is True
+
+    def finishRecord(self, records):
+        if (self.handshakeData is not None):
+            self.clientHello = bytes(self.handshakeData)
+            self.handshakeData = None
+        records.append(self.currentRecord)
+
+
+# Yield (timestamp, stream index, direction, content type, length) for each TLS record in a capture.
+# The timestamp is the time of the packet that completes the record and the stream index numbers the TCP
+# connections in the order they are seen. The direction is 1 towards the server and -1 towards the client.
+# If 'serverPort' is given, only connections with that port are analyzed and it decides the direction.
+# If 'domainName' (bytes) is given, only connections with a Client Hello for that domain (or a subdomain) are analyzed.
+def iterTLSRecords(fileObj, serverPort=None, domainName=None):
+    streams = {}
+    clientStreams = {}
+    numberStreams = 0
+    for timestamp, linkType, frame in iterPackets(fileObj):
+        segment = parseTCP(linkType, frame)
+        if (segment is None):
+            continue
+        sourceAddress, sourcePort, destinationAddress, destinationPort, seq, flags, payload = segment
+        if (serverPort is not None and sourcePort != serverPort and destinationPort != serverPort):
+            continue
+
+        key = (sourceAddress, sourcePort, destinationAddress, destinationPort)
+        stream = streams.get(key)
+        if (stream is None):
+            reverseStream = streams.get((destinationAddress, destinationPort, sourceAddress, sourcePort))
+            if (reverseStream is not None):
+                streamIndex = reverseStream.streamIndex
+                direction = -reverseStream.direction
+            else:
+                streamIndex = numberStreams
+                numberStreams += 1
+                if (serverPort is not None):
+                    direction = 1 if destinationPort == serverPort else -1
+                elif (flags & TCP_SYN):
+                    direction = -1 if flags & TCP_ACK else 1
+                else:
+                    direction = 1 if destinationPort < sourcePort else -1
+            stream = TLSStream(streamIndex, direction)
+            streams[key] = stream
+            if (direction == 1):
+                clientStreams[streamIndex] = stream
+
+        for contentType, length in stream.addSegment(seq, flags, payload):
+            if (domainName is not None):
+                clientStream = clientStreams.get(stream.streamIndex)
+                if (clientStream is None or not clientStream.isTargeted(domainName)):
+                    continue
+            yield timestamp, stream.streamIndex, stream.direction, contentType, length
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2):
+        print("Usage: python PcapReader.py <capture> [<server_port>]")
+        exit(1)
+
+    serverPort = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    captureFile = open(sys.argv[1], "rb")
+    for timestamp, streamIndex, direction, contentType, length in iterTLSRecords(captureFile, serverPort):
+        print(repr(timestamp) + " " + repr(streamIndex) + " " + repr(direction) + " " + repr(contentType) + " " + repr(length))
+    captureFile.close()
@@ -0,0 +1,207 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Columnar cache of a dataset directory with '<profile>_<iteration>.txt' (or binary '.trace') traces.
+# The traces are compiled once into NumPy arrays which are memory-mapped by ImprovedIUPTIS_PERFORM.py,
+# so no trace has to be re-parsed as long as the dataset directory does not change.
+# Usage: python TraceCache.py <dataset_directory>
+
+import sys
+import os
+import re
+import json
+import numpy as np
+import TraceFormat
+from TraceFormat import parseHeaderLine
+
+
+CACHE_DIRECTORY = ".iuptis_cache"
+CACHE_VERSION = 1
+TRACE_NAME = TraceFormat.TRACE_NAME
+
+# All columns of the cache with their NumPy type.
+#   profiles, iterations: Profile and iteration index of each trace (taken from the file name).
+#   traceOffsets: Offsets of each trace in 'traceConnOffsets' (number of traces + 1 elements).
+#   traceConnOffsets: Start of each TCP connection in the record columns (number of connections + 1 elements).
+#   timestamps, lengths, directions: One element per TLS record.
+#   imageOffsets: Offsets of each trace in 'imageSizes' (number of traces + 1 elements).
+#   imageSizes: Image sizes of the header line of each trace.
+COLUMNS = {
+    "profiles": np.int32,
+    "iterations": np.int32,
+    "traceOffsets": np.int64,
+    "traceConnOffsets": np.int64,
+    "timestamps": np.int64,
+    "lengths": np.int32,
+    "directions": np.int8,
+    "imageOffsets": np.int64,
+    "imageSizes": np.int32,
+}
+
+
+def getCacheDirectory(datasetDir):
+    return os.path.join(datasetDir, CACHE_DIRECTORY)
+
+
+# List all trace files of a dataset directory, ordered by profile and iteration. If a trace is saved in both
+# formats, only the binary one is listed.
+def listTraceFiles(datasetDir):
+    allFiles = {}
+    for fileName in os.listdir(datasetDir):
+        match = TRACE_NAME.match(fileName)
+        if (match):
+            key = (int(match.group(1)), int(match.group(2)))
+            if (key not in allFiles or TraceFormat.isBinaryTrace(fileName)):
+                allFiles[key] = fileName
+    return sorted((profile, iteration, fileName) for (profile, iteration), fileName in allFiles.items())
+
+
+# The cache is stale as soon as a trace file is added, removed or modified.
+def getDatasetSignature(datasetDir, traceFiles):
+    signature = {}
+    for profile, iteration, fileName in traceFiles:
+        stat = os.stat(os.path.join(datasetDir, fileName))
+        signature[fileName] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def compileDataset(datasetDir):
+    traceFiles = listTraceFiles(datasetDir)
+    columns = {name: [] for name in COLUMNS}
+    columns["traceOffsets"].append(0)
+    columns["imageOffsets"].append(0)
+
+    for profile, iteration, fileName in traceFiles:
+        if (TraceFormat.isBinaryTrace(fileName)):
+            imageSizes, connections = TraceFormat.readTraceFile(os.path.join(datasetDir, fileName))
+            columns["profiles"].append(profile)
+            columns["iterations"].append(iteration)
+            columns["imageSizes"].extend(imageSizes)
+            columns["imageOffsets"].append(len(columns["imageSizes"]))
+            for connection in connections:
+                columns["traceConnOffsets"].append(len(columns["lengths"]))
+                columns["timestamps"].extend(connection.timestamps)
+                columns["lengths"].extend(connection.lengths)
+                columns["directions"].extend(connection.directions)
+            columns["traceOffsets"].append(len(columns["traceConnOffsets"]))
+            continue
+
+        traceData = open(os.path.join(datasetDir, fileName), "r")
+        headerLine = traceData.readline()
+        columns["profiles"].append(profile)
+        columns["iterations"].append(iteration)
+        columns["imageSizes"].extend(parseHeaderLine(headerLine))
+        columns["imageOffsets"].append(len(columns["imageSizes"]))
+
+        # Each TCP connection is seperated by 0,0,0.
+        inConn = False
+        for line in traceData:
+            tlsRec = line.split()
+            if (len(tlsRec) < 3):
+                continue
+            if (tlsRec[0] == "0" and tlsRec[1] == "0"):
+                inConn = False
+                continue
+            if (not inConn):
+                columns["traceConnOffsets"].append(len(columns["lengths"]))
+                inConn = True
+            columns["timestamps"].append(int(tlsRec[0]))
+            columns["lengths"].append(int(tlsRec[1]))
+            columns["directions"].append(int(tlsRec[2]))
+        traceData.close()
+        columns["traceOffsets"].append(len(columns["traceConnOffsets"]))
+
+    columns["traceConnOffsets"].append(len(columns["lengths"]))
+
+    cacheDir = getCacheDirectory(datasetDir)
+    os.makedirs(cacheDir, exist_ok=True)
+    for name in COLUMNS:
+        np.save(os.path.join(cacheDir, name + ".npy"), np.array(columns[name], dtype=COLUMNS[name]))
+
+    # The manifest is written last, so an interrupted compilation is never seen as a valid cache.
+    manifest = {"version": CACHE_VERSION, "signature": getDatasetSignature(datasetDir, traceFiles)}
+    manifestFile = open(os.path.join(cacheDir, "manifest.json"), "w")
+    manifestFile.write(json.dumps(manifest))
+    manifestFile.close()
+    return len(traceFiles), len(columns["lengths"])
+
+
+class TraceCache(object):
+    def __init__(self, cacheDir):
+        self.columns = {}
+        for name in COLUMNS:
+            self.columns[name] = np.load(os.path.join(cacheDir, name + ".npy"), mmap_mode="r")
+        self.traceIndex = {}
+        for t, (profile, iteration) in enumerate(zip(self.columns["profiles"].tolist(), self.columns["iterations"].tolist())):
+            self.traceIndex[(profile, iteration)] = t
+
+    # Index of the trace of the given profile and iteration, -1 if it is not part of the dataset.
+    def findTrace(self, profile, iteration):
+        return self.traceIndex.get((profile, iteration), -1)
+
+    def getImageSizes(self, t):
+        imageOffsets = self.columns["imageOffsets"]
+        return self.columns["imageSizes"][imageOffsets[t]:imageOffsets[t + 1]].tolist()
+
+    # Yield the timestamps, lengths and directions of each TCP connection of a trace (views, no copies).
+    def getConnections(self, t):
+        traceOffsets = self.columns["traceOffsets"]
+        connOffsets = self.columns["traceConnOffsets"]
+        for c in range(traceOffsets[t], traceOffsets[t + 1]):
+            start = connOffsets[c]
+            end = connOffsets[c + 1]
+            yield self.columns["timestamps"][start:end], self.columns["lengths"][start:end], self.columns["directions"][start:end]
+
+
+# Open the cache of a dataset directory. Returns None if there is no cache or if it is stale.
+def openCache(datasetDir):
+    cacheDir = getCacheDirectory(datasetDir)
+    try:
+        manifestFile = open(os.path.join(cacheDir, "manifest.json"), "r")
+        manifest = json.loads(manifestFile.read())
+        manifestFile.close()
+    except (OSError, ValueError):
+        return None
+
+    if (manifest.get("version") != CACHE_VERSION):
+        return None
+    if (manifest.get("signature") != getDatasetSignature(datasetDir, listTraceFiles(datasetDir))):
+        return None
+    return TraceCache(cacheDir)
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2):
+        print("Usage: python TraceCache.py <dataset_directory>")
+        exit(1)
+
+    numberTraces, numberRecords = compileDataset(sys.argv[1])
+    print("Compiled " + str(numberTraces) + " traces with " + str(numberRecords) + " TLS records into " + getCacheDirectory(sys.argv[1]))
@@ -0,0 +1,454 @@
+# MIT License
+#
+# Copyright (c) 2019 Mariano Di Martino
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# **********************************************************************************
+# Realistically Fingerprinting Social Media Webpages in HTTPS Traffic
+# Hasselt University/EDM/Flanders Make.
+# Paper published by ACM ICPS, ARES 2019.
+# Authors: Mariano Di Martino, Peter Quax, Wim Lamotte.
+# Please cite the paper if you are using this source code.
+# Licensed under: MIT License
+# *****************************************************************************************
+
+# Format of the traces of a dataset ('<profile>_<iteration>.txt'). The first line holds the sizes of the images of the profile,
+# followed by the TLS records ('<time> <length> <direction>') of each TCP connection, each connection starting with '0 0 0'.
+# Shared by tcpproxy.py, ImprovedIUPTIS_COLLECT.py, ImprovedIUPTIS_CONVERT.py and ImprovedIUPTIS_PERFORM.py.
+#
+# The same traces can also be saved in a binary format ('<profile>_<iteration>.trace'):
+#   Header: "IUPT", version (1 byte), compression (1 byte: 0 none, 1 lzma, 2 zstd), then a varint with the number of
+#           images and a varint with the byte length of the image sizes, followed by the image sizes (varints).
+#   Body (compressed as one block if compression is not 0): varints with the number of connections, the number of
+#           records and the byte length of the 3 columns below, followed by these columns:
+#           - Number of records of each connection (varints).
+#           - Timestamp of each record minus the one of the previous record (zigzag varints).
+#           - Length of each record, shifted left by one bit, with the lowest bit set if the direction is -1 (zigzag varints).
+#   Varints store 7 bits per byte, with the highest bit set on all bytes but the last one.
+# Usage: python TraceFormat.py binary <dataset_directory> [none|lzma|zstd]
+#        python TraceFormat.py text <dataset_directory>
+
+import sys
+import os
+import re
+import io
+import array
+import lzma
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Image record of the add-on: original length of the image, start and end time of its response.
+IMAGE_RECORD = np.dtype([("length", np.int64), ("start", np.int64), ("end", np.int64)])
+
+def getImageSizes(rawURLData,numberPhotos,profileName):
+    # Extract information from all the original images in a single pass.
+    # An image that is downloaded more than once only counts once, with its earliest response.
+    firstRecords = {}
+    for line in rawURLData:
+        splitted = line.split(' ')
+        if (len(splitted) < 4):
+            continue
+        record = (int(splitted[1]), int(float(splitted[2])*1000) * 100, int(float(splitted[3])*1000) * 100)
+        previousRecord = firstRecords.get(splitted[0])
+        if (previousRecord is None or record[1] < previousRecord[1]):
+            firstRecords[splitted[0]] = record
+
+    if (len(firstRecords) == 0):
+        print("WARNING: No data hold.")
+        return False, None
+
+    # Order the images by the time they were requested.
+    images = np.array(list(firstRecords.values()), dtype=IMAGE_RECORD)
+    images = images[np.argsort(images["start"], kind="stable")]
+
+    if (len(images) < numberPhotos):
+        print("WARNING: Profile '" + profileName[:-1] + "' has only " + repr(len(images)) + " photos. Skipping...")
+        return False, None
+
+    return True, images
+
+
+# A single TLS record: time (in microseconds), length (without the TLS overhead) and direction (-1 from the server, 1 to the server).
+class TLSRecord(object):
+    __slots__ = ("timestamp", "length", "direction")
+
+    def __init__(self, timestamp, length, direction):
+        self.timestamp = timestamp
+        self.length = length
+        self.direction = direction
+
+    def __repr__(self):
+        return "TLSRecord(" + repr(self.timestamp) + ", " + repr(self.length) + ", " + repr(self.direction) + ")"
+
+
+# TLS records of one TCP connection, stored as array-backed columns (13 bytes per record) instead of a list or dict per record.
+# The direction is appended last, so len(directions) records are always complete in all columns. A single writer can
+# append while other threads read (see tcpproxy.py).
+class RecordColumns(object):
+    __slots__ = ("timestamps", "lengths", "directions")
+
+    def __init__(self):
+        self.timestamps = array.array("q")
+        self.lengths = array.array("i")
+        self.directions = array.array("b")
+
+    @classmethod
+    def fromArrays(cls, timestamps, lengths, directions):
+        columns = cls()
+        columns.timestamps.frombytes(np.ascontiguousarray(timestamps, dtype=np.int64).tobytes())
+        columns.lengths.frombytes(np.ascontiguousarray(lengths, dtype=np.int32).tobytes())
+        columns.directions.frombytes(np.ascontiguousarray(directions, dtype=np.int8).tobytes())
+        return columns
+
+    def append(self, timestamp, length, direction):
+        self.timestamps.append(timestamp)
+        self.lengths.append(length)
+        self.directions.append(direction)
+
+    def __len__(self):
+        return len(self.directions)
+
+    def __getitem__(self, i):
+        return TLSRecord(self.timestamps[i], self.lengths[i], self.directions[i])
+
+    def __iter__(self):
+        for i in range(0, len(self.directions)):
+            yield TLSRecord(self.timestamps[i], self.lengths[i], self.directions[i])
+
+    # Copy of the records in [start, end).
+    def slice(self, start, end):
+        columns = RecordColumns()
+        columns.timestamps = self.timestamps[start:end]
+        columns.lengths = self.lengths[start:end]
+        columns.directions = self.directions[start:end]
+        return columns
+
+    # The columns as NumPy arrays (timestamps, lengths, directions), without copying them.
+    def getArrays(self):
+        end = len(self.directions)
+        return (np.frombuffer(self.timestamps, dtype=np.int64, count=end), np.frombuffer(self.lengths, dtype=np.int32, count=end),
+                np.frombuffer(self.directions, dtype=np.int8, count=end))
+
+
+# Parse the image sizes from the header line (### "'<size> <size> ...'").
+def parseHeaderLine(headerLine):
+    sizes = headerLine[4:].strip().strip("\"'")
+    if (sizes == ""):
+        return []
+    return [int(s) for s in sizes.split(' ')]
+
+
+def formatHeaderLine(imageSizes):
+    return "### " + repr(repr(' '.join(str(s) for s in imageSizes))) + "\n"
+
+
+# Write the TLS records of each connection, given as RecordColumns or as (timestamps, lengths, directions).
+def writeConnections(traceFile, connections):
+    for connection in connections:
+        if (isinstance(connection, RecordColumns)):
+            connection = connection.getArrays()
+        timestamps, lengths, directions = connection
+        lines = ["0 0 0\n"]
+        lines.extend(str(t) + " " + str(l) + " " + str(d) + "\n" for t, l, d in zip(np.asarray(timestamps).tolist(), np.asarray(lengths).tolist(),
+                                                                                    np.asarray(directions).tolist()))
+        traceFile.write("".join(lines))
+
+
+# Yield the TLS records of the lines of a trace one by one as (timestamp, length, direction), and None for each line
+# '0 0 0' that starts a TCP connection. Only the current line is kept in memory.
+def iterRecords(lines):
+    for line in lines:
+        tlsRec = line.split()
+        if (len(tlsRec) == 0):
+            continue
+        if (len(tlsRec) != 3):
+            raise ValueError("Trace has an incomplete TLS record.")
+        if (tlsRec[0] == "0" and tlsRec[1] == "0"):
+            yield None
+        else:
+            yield int(tlsRec[0]), int(tlsRec[1]), int(tlsRec[2])
+
+
+# Yield a RecordColumns for each TCP connection of the lines of a trace, reading the lines one connection at a time.
+def readConnections(lines):
+    connection = RecordColumns()
+    isFirst = True
+    for record in iterRecords(lines):
+        if (record is not None):
+            connection.append(record[0], record[1], record[2])
+            continue
+        # Records before the first '0 0 0' form a connection as well.
+        if (not isFirst or len(connection) > 0):
+            yield connection
+        connection = RecordColumns()
+        isFirst = False
+    if (not isFirst or len(connection) > 0):
+        yield connection
+
+
+# Read a whole trace file: the image sizes of its header line and a RecordColumns per TCP connection.
+def readTrace(traceFile):
+    imageSizes = parseHeaderLine(traceFile.readline())
+    return imageSizes, list(readConnections(traceFile))
+
+
+BINARY_MAGIC = b"IUPT"
+BINARY_VERSION = 1
+COMPRESSIONS = {"none": 0, "lzma": 1, "zstd": 2}
+# Extensions of the traces of a dataset, the binary trace is used if a trace is saved in both formats.
+TRACE_EXTENSIONS = (".trace", ".txt")
+TRACE_NAME = re.compile(r"^(\d+)_(\d+)\.(txt|trace)$")
+
+
+def encodeVarint(value):
+    data = bytearray()
+    while (value >= 0x80):
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+# Read one varint from a file.
+def readVarint(traceFile):
+    value = 0
+    shift = 0
+    while (True):
+        byte = traceFile.read(1)
+        if (len(byte) == 0):
+            raise ValueError("Trace ends in the middle of a varint.")
+        value |= (byte[0] & 0x7f) << shift
+        if (byte[0] < 0x80):
+            return value
+        shift += 7
+
+
+# Encode an array of unsigned integers as varints, one byte position at a time for all values.
+def encodeVarints(values):
+    values = np.asarray(values, dtype=np.uint64)
+    numberBytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while (rest.any()):
+        numberBytes += (rest > 0)
+        rest >>= np.uint64(7)
+    data = np.empty(int(numberBytes.sum()), dtype=np.uint8)
+    starts = np.cumsum(numberBytes) - numberBytes
+    rest = values.copy()
+    for position in range(0, int(numberBytes.max()) if len(values) > 0 else 0):
+        isUsed = (numberBytes > position)
+        hasMore = (numberBytes[isUsed] > position + 1).astype(np.uint8) << np.uint8(7)
+        data[starts[isUsed] + position] = (rest[isUsed] & np.uint64(0x7f)).astype(np.uint8) | hasMore
+        rest >>= np.uint64(7)
+    return data.tobytes()
+
+
+def decodeVarints(data, count):
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.nonzero(data < 0x80)[0]
+    if (len(ends) != count or (count > 0 and ends[-1] != len(data) - 1)):
+        raise ValueError("Trace has " + repr(len(ends)) + " varints instead of " + repr(count) + ".")
+    if (count == 0):
+        return np.zeros(0, dtype=np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(0, len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7f).astype(np.uint64) << (position * 7).astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def encodeZigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def decodeZigzag(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def compressBody(body, compression):
+    if (compression == "lzma"):
+        return lzma.compress(body)
+    if (compression == "zstd"):
+        if (zstandard is None):
+            raise ValueError("zstd compression needs the 'zstandard' package.")
+        return zstandard.ZstdCompressor().compress(body)
+    return body
+
+
+def decompressBody(body, compressionId):
+    if (compressionId == COMPRESSIONS["lzma"]):
+        return lzma.decompress(body)
+    if (compressionId == COMPRESSIONS["zstd"]):
+        if (zstandard is None):
+            raise ValueError("Trace is compressed with zstd, which needs the 'zstandard' package.")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if (compressionId != COMPRESSIONS["none"]):
+        raise ValueError("Unknown compression " + repr(compressionId) + ".")
+    return body
+
+
+# Write a binary trace with the image sizes and the records of each connection (RecordColumns or (timestamps, lengths, directions)).
+def writeBinaryTrace(traceFile, imageSizes, connections, compression="none"):
+    if (compression not in COMPRESSIONS):
+        raise ValueError("Unknown compression '" + compression + "'.")
+    allColumns = [connection.getArrays() if isinstance(connection, RecordColumns) else connection for connection in connections]
+    timestamps = np.concatenate([np.asarray(c[0], dtype=np.int64) for c in allColumns] + [np.zeros(0, dtype=np.int64)])
+    lengths = np.concatenate([np.asarray(c[1], dtype=np.int64) for c in allColumns] + [np.zeros(0, dtype=np.int64)])
+    directions = np.concatenate([np.asarray(c[2], dtype=np.int64) for c in allColumns] + [np.zeros(0, dtype=np.int64)])
+    if (not np.all(np.abs(directions) == 1)):
+        raise ValueError("The direction of a TLS record has to be 1 or -1.")
+
+    numberRecords = encodeVarints([len(c[2]) for c in allColumns])
+    timeDeltas = encodeVarints(encodeZigzag(np.diff(timestamps, prepend=np.int64(0))))
+    lengthDirections = encodeVarints(encodeZigzag(lengths) << np.uint64(1) | (directions < 0).astype(np.uint64))
+    body = b"".join([encodeVarint(len(allColumns)), encodeVarint(len(timestamps)), encodeVarint(len(numberRecords)),
+                     encodeVarint(len(timeDeltas)), encodeVarint(len(lengthDirections)), numberRecords, timeDeltas, lengthDirections])
+
+    images = encodeVarints([int(s) for s in imageSizes])
+    traceFile.write(BINARY_MAGIC + bytes([BINARY_VERSION, COMPRESSIONS[compression]]) + encodeVarint(len(imageSizes)) +
+                    encodeVarint(len(images)) + images + compressBody(body, compression))
+
+
+# Read the header of a binary trace. Returns the compression and the image sizes.
+def readBinaryHeader(traceFile):
+    header = traceFile.read(6)
+    if (len(header) < 6 or header[:4] != BINARY_MAGIC):
+        raise ValueError("Not a binary trace.")
+    if (header[4] != BINARY_VERSION):
+        raise ValueError("Unsupported version " + repr(header[4]) + " of binary trace.")
+    numberImages = readVarint(traceFile)
+    imageSizes = decodeVarints(traceFile.read(readVarint(traceFile)), numberImages).astype(np.int64).tolist()
+    return header[5], imageSizes
+
+
+# Read a binary trace: the image sizes and a RecordColumns per TCP connection.
+def readBinaryTrace(traceFile):
+    compressionId, imageSizes = readBinaryHeader(traceFile)
+    body = io.BytesIO(decompressBody(traceFile.read(), compressionId))
+    numberConnections = readVarint(body)
+    numberRecords = readVarint(body)
+    columnLengths = [readVarint(body) for c in range(0, 3)]
+    recordsPerConnection = decodeVarints(body.read(columnLengths[0]), numberConnections).astype(np.int64)
+    timestamps = np.cumsum(decodeZigzag(decodeVarints(body.read(columnLengths[1]), numberRecords)))
+    lengthDirections = decodeVarints(body.read(columnLengths[2]), numberRecords)
+    lengths = decodeZigzag(lengthDirections >> np.uint64(1))
+    directions = 1 - 2 * (lengthDirections & np.uint64(1)).astype(np.int64)
+    if (recordsPerConnection.sum() != numberRecords):
+        raise ValueError("Trace has " + repr(int(recordsPerConnection.sum())) + " records in its connections instead of " + repr(numberRecords) + ".")
+
+    # The columns are converted once, each connection only copies its part of them.
+    timestampBytes = timestamps.astype(np.int64).tobytes()
+    lengthBytes = lengths.astype(np.int32).tobytes()
+    directionBytes = directions.astype(np.int8).tobytes()
+    connections = []
+    start = 0
+    for end in np.cumsum(recordsPerConnection).tolist():
+        columns = RecordColumns()
+        columns.timestamps.frombytes(timestampBytes[start * 8:end * 8])
+        columns.lengths.frombytes(lengthBytes[start * 4:end * 4])
+        columns.directions.frombytes(directionBytes[start:end])
+        connections.append(columns)
+        start = end
+    return imageSizes, connections
+
+
+def isBinaryTrace(path):
+    return path.endswith(".trace")
+
+
+# Path of the trace of the given profile and iteration in a dataset directory, None if there is no trace.
+def getTracePath(datasetDir, profile, iteration):
+    for extension in TRACE_EXTENSIONS:
+        path = os.path.join(datasetDir, repr(profile) + "_" + repr(iteration) + extension)
+        if (os.path.isfile(path)):
+            return path
+    return None
+
+
+# Read a trace in either format: the image sizes and a RecordColumns per TCP connection.
+def readTraceFile(path):
+    if (isBinaryTrace(path)):
+        traceFile = open(path, "rb")
+        imageSizes, connections = readBinaryTrace(traceFile)
+    else:
+        traceFile = open(path, "r")
+        imageSizes, connections = readTrace(traceFile)
+    traceFile.close()
+    return imageSizes, connections
+
+
+# Only read the image sizes of a trace in either format.
+def readTraceImages(path):
+    if (isBinaryTrace(path)):
+        traceFile = open(path, "rb")
+        compressionId, imageSizes = readBinaryHeader(traceFile)
+    else:
+        traceFile = open(path, "r")
+        imageSizes = parseHeaderLine(traceFile.readline())
+    traceFile.close()
+    return imageSizes
+
+
+# Write a trace in the format of its extension.
+def writeTraceFile(path, imageSizes, connections, compression="none"):
+    if (isBinaryTrace(path)):
+        traceFile = open(path, "wb")
+        writeBinaryTrace(traceFile, imageSizes, connections, compression)
+    else:
+        traceFile = open(path, "w")
+        traceFile.write(formatHeaderLine(imageSizes))
+        writeConnections(traceFile, connections)
+    traceFile.close()
+
+
+# Convert all traces of a dataset directory to the binary format (or back to the text format). The original traces are kept.
+def convertDataset(datasetDir, toBinary, compression):
+    numberTraces = 0
+    for fileName in sorted(os.listdir(datasetDir)):
+        match = TRACE_NAME.match(fileName)
+        if (not match or isBinaryTrace(fileName) == toBinary):
+            continue
+        imageSizes, connections = readTraceFile(os.path.join(datasetDir, fileName))
+        newName = match.group(1) + "_" + match.group(2) + (".trace" if toBinary else ".txt")
+        writeTraceFile(os.path.join(datasetDir, newName), imageSizes, connections, compression)
+        numberTraces += 1
+    return numberTraces
+
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 3 or sys.argv[1] not in ("binary", "text")):
+        print("Usage: python TraceFormat.py binary <dataset_directory> [none|lzma|zstd]")
+        print("       python TraceFormat.py text <dataset_directory>")
+        exit(1)
+
+    compression = sys.argv[3] if len(sys.argv) > 3 else "none"
+    if (compression not in COMPRESSIONS):
+        print("Error: Unknown compression '" + compression + "'.")
+        exit(1)
+    if (compression == "zstd" and zstandard is None):
+        print("Error: zstd compression needs the 'zstandard' package.")
+        exit(1)
+    numberTraces = convertDataset(sys.argv[2], sys.argv[1] == "binary", compression)
+    print("Converted " + repr(numberTraces) + " traces in " + sys.argv[2])
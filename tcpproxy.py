@@ -38,51 +38,153 @@ import socket
 import threading
 import select
 import struct
+import asyncio
+import collections
+import json
+import HandshakeParser
+import TraceFormat
 from enum import Enum
 from threading import Thread, Lock
 
+# Record log of each proxied connection. The lock is only taken when a connection is added and when the logs
+# are cleared or written, never for a single TLS record.
 allTLS = {}
 mutex = Lock()
+# Optional live classifier (see LiveClassifier.py) that queues each TLS record as soon as it is logged.
+liveClassifier = None
 
-def addTLSRecord(id,tlsLen,direction,timestamp):
+
+# Append-only log of the TLS records of one connection, stored as array-backed columns (see TraceFormat.RecordColumns).
+# Only the thread (or event loop) of the connection appends to it, other threads only read a snapshot.
+class TLSRecordLog(object):
     sslOverhead = 24
+
+    def __init__(self, name):
+        self.name = name
+        self.records = TraceFormat.RecordColumns()
+        # Records before this index are cleared (see clearRecords).
+        self.clearedAt = 0
+        self.isClosed = False
+
+    # The timestamp (in seconds) is stored in microseconds, as in the traces.
+    def append(self, tlsLen, direction, timestamp):
+        self.records.append(int(timestamp*1000000), tlsLen - self.sslOverhead, direction)
+        if (liveClassifier is not None):
+            liveClassifier.addRecord(self.name, tlsLen - self.sslOverhead, direction)
+
+    def __len__(self):
+        return len(self.records)
+
+    # Copy of all records after the last clearRecords(), as RecordColumns.
+    def snapshot(self):
+        end = len(self.records)
+        return self.records.slice(min(self.clearedAt, end), end)
+
+
+# Get the record log of a connection. A closed connection with the same name (a reused port) continues its log.
+def openRecordLog(id):
     mutex.acquire()
-    global allTLS
     if (id not in allTLS):
-        allTLS[id] = []
-
-    allTLS[id].append([tlsLen-sslOverhead,direction,timestamp])
+        allTLS[id] = TLSRecordLog(id)
+    recordLog = allTLS[id]
+    recordLog.isClosed = False
     mutex.release()
+    return recordLog
+
+def addTLSRecord(id,tlsLen,direction,timestamp):
+    recordLog = allTLS.get(id)
+    if (recordLog is None):
+        recordLog = openRecordLog(id)
+    recordLog.append(tlsLen,direction,timestamp)
 
 def clearRecords():
     global allTLS
     mutex.acquire()
-    allTLS = {}
+    # Logs of closed connections are dropped, open connections continue after their current records.
+    openLogs = {}
+    for sockname in allTLS:
+        recordLog = allTLS[sockname]
+        recordLog.clearedAt = len(recordLog)
+        if (not recordLog.isClosed):
+            openLogs[sockname] = recordLog
+    allTLS = openLogs
     mutex.release()
-
-# Write all TLS records to tls_output.txt
-def writeRecords():
+    # A new profile is requested, so the live classifier starts a new session.
+    if (liveClassifier is not None):
+        liveClassifier.reset()
+
+# Output file of the proxy on the given port. Every proxy (one per collection worker) has its own file.
+# The extension is ".txt" for the text format and ".trace" for the binary format (see TraceFormat.py).
+def getOutputFileName(proxyPort, extension=".txt"):
+    if (proxyPort == 81):
+        return "tls_output" + extension
+    return "tls_output_" + str(proxyPort) + extension
+
+# Write all TLS records to tls_output.txt, or to a binary trace without images if the file name ends with ".trace".
+def writeRecords(fileName="tls_output.txt"):
     mutex.acquire()
+    allLogs = list(allTLS.values())
+    mutex.release()
+
+    # Connections are written in the order of their first record.
+    allSnapshots = [recordLog.snapshot() for recordLog in allLogs]
+    allSnapshots = [snap for snap in allSnapshots if len(snap) > 0]
+    allSnapshots.sort(key=lambda snap: snap.timestamps[0])
+
     try:
-        os.remove("tls_output.txt")
+        os.remove(fileName)
     except:
         pass
-    f = open("tls_output.txt","w")
-    for sockname in allTLS:
-        conn = allTLS[sockname]
-        f.write("0 0 0\n")
-        for rec in conn:
-            f.write(str(int(rec[2]*1000000)) + " " + str(rec[0]) + " " + str(rec[1]) + "\n")
+    if (TraceFormat.isBinaryTrace(fileName)):
+        f = open(fileName,"wb")
+        TraceFormat.writeBinaryTrace(f, [], allSnapshots)
+    else:
+        f = open(fileName,"w")
+        TraceFormat.writeConnections(f, allSnapshots)
     f.close()
-    mutex.release()
+
+
+# Close function of each open proxied connection, so ImprovedIUPTIS_COLLECT.py can close all of them between two profiles.
+openConnections = {}
+connectionsLock = Lock()
+connectionCounter = 0
+
+def registerConnection(closeFunction):
+    global connectionCounter
+    connectionsLock.acquire()
+    connectionCounter += 1
+    connectionID = connectionCounter
+    openConnections[connectionID] = closeFunction
+    connectionsLock.release()
+    return connectionID
+
+def unregisterConnection(connectionID):
+    connectionsLock.acquire()
+    openConnections.pop(connectionID, None)
+    connectionsLock.release()
+
+def closeConnections():
+    connectionsLock.acquire()
+    allCloseFunctions = list(openConnections.values())
+    connectionsLock.release()
+    for closeFunction in allCloseFunctions:
+        closeFunction()
+
+# Shutting down the sockets wakes up the thread of the connection, which then handles it as a disconnect.
+def shutdownSockets(allSockets):
+    for sock in allSockets:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
 
 # Communication thread with ImprovedIUPTIS_COLLECT.py
-def communicate():
+def communicate(port=82, outputFile="tls_output.txt"):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 120)
-    sock.bind(('127.0.0.1', 82))
+    sock.bind(('127.0.0.1', port))
     sock.listen(1)
     while True:
         client, address = sock.accept()
@@ -96,11 +198,23 @@ def communicate():
                 continue
             else:
                 if (data == b"\x01"):
-                    writeRecords()
+                    writeRecords(outputFile)
+                    client.send(b"\xff")
+                elif (data == b"\x05"):
+                    # Same as 0x01, in the binary trace format.
+                    writeRecords(os.path.splitext(outputFile)[0] + ".trace")
                     client.send(b"\xff")
                 elif (data == b"\x02"):
                     clearRecords()
                     client.send(b"\xff")
+                elif (data == b"\x03"):
+                    closeConnections()
+                    client.send(b"\xff")
+                elif (data == b"\x04"):
+                    # Ranked prediction of the live classifier, as a 4-byte length followed by JSON.
+                    ranking = liveClassifier.getRanking() if liveClassifier is not None else []
+                    encodedRanking = json.dumps(ranking).encode()
+                    client.send(struct.pack(">I", len(encodedRanking)) + encodedRanking)
                 else:
                     print("WARNING: Unknown command from client. Closing socket ...")
                     client.close()
@@ -175,13 +289,12 @@ class ThreadedServer(object):
         client.send(b"HTTP/1.1 200 Connection Established\r\nConnection: close\r\n\r\n")
 
     def listenToClient(self, client, address):
-        response = b""
+        connectParser = HandshakeParser.ConnectRequestParser()
         while True:
             isConnected = False
             data = client.recv(self.recvSize)
             if data:
-                response += data
-                isConnected,outHostname,outPort = self.handleHTTPConnect(response)
+                isConnected,outHostname,outPort = connectParser.feed(data)
                 if (isConnected):
                     self.send200Connect(client)
                     break
@@ -191,48 +304,27 @@ class ThreadedServer(object):
                 return False
 
 
-        # Is this request targeted to our address?
-        if (self.targetAddr in outHostname):
-            # Outgoing socket.
-            sc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sc.connect((outHostname, int(outPort)))
-            sc.setblocking(True)
-            client.setblocking(True)
-
-            self.isBusy = True
-            print("Handling TARGET host: " + str(outHostname))
-            val = self.handleIUPTISStream(client,address,sc)
-            self.isBusy = False
-            return val
-        else:
-            # Outgoing socket.
-            sc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sc.connect((outHostname, int(outPort)))
-            sc.setblocking(True)
-            client.setblocking(True)
-
-            print("Host: " + str(outHostname))
-            return self.handleStream(client,address,sc)
-
-
-    def handleHTTPConnect(self,strConn):
-        if (strConn.find(b"\r\n\r\n") == -1):
-            return False, "", ""
-
-        sIndex = strConn.find(b"\r\nHost: ")
-        midIndex = strConn.find(b"\r\n",sIndex+8)
-        eIndex = strConn.find(b":", sIndex+8,midIndex)
-        e2Index = strConn.find(b"\r\n", eIndex+1)
-
-        if (eIndex != -1):
-            outHostname = strConn[sIndex+8:eIndex]
-            outPort = strConn[eIndex+1:e2Index]
-        else:
-            outHostname = strConn[sIndex + 8:midIndex]
-            outPort = "80"
-
+        # Outgoing socket.
+        sc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sc.connect((outHostname, int(outPort)))
+        sc.setblocking(True)
+        client.setblocking(True)
+        connectionID = registerConnection(lambda: shutdownSockets([client, sc]))
+
+        try:
+            # Is this request targeted to our address?
+            if (HandshakeParser.isTargetedHost(outHostname, self.targetAddr)):
+                self.isBusy = True
+                print("Handling TARGET host: " + str(outHostname))
+                val = self.handleIUPTISStream(client,address,sc)
+                self.isBusy = False
+                return val
+            else:
+                print("Host: " + str(outHostname))
+                return self.handleStream(client,address,sc)
+        finally:
+            unregisterConnection(connectionID)
 
-        return True, outHostname, outPort
 
     def handleIUPTISStream(self,client,address,outSock):
         iupDel = IUPTISDelay(outSock.getsockname(),self.timeWait)
@@ -254,16 +346,17 @@ class ThreadedServer(object):
             for w in writeable:
                 if w is client:
                     print("Sending data to client.")
-                    client.send(iupDel.getDataForClient())
+                    iupDel.sendDataToClient(client)
                 elif w is outSock:
                     print("Sending data to server.")
-                    outSock.send(iupDel.getDataForServer())
+                    iupDel.sendDataToServer(outSock)
             for r in readable:
                 if r is client:
                     data = client.recv(self.recvSize)
                     if not data:
                         print("Target client disconnected.")
                         self.isBusy = False
+                        iupDel.close()
                         outSock.close()
                         return True
                     iupDel.sendToServer(data)
@@ -272,10 +365,139 @@ class ThreadedServer(object):
                     if not data:
                         print("Target server disconnected.")
                         self.isBusy = False
+                        iupDel.close()
                         client.close()
                         return True
                     iupDel.sendToClient(data)
 
+# Same proxy as ThreadedServer, but all connections are handled by a single asyncio event loop.
+# Sockets are only read when data is available, and the WAIT_COMPLETION timeout of IUPTISDelay is a scheduled callback.
+class AsyncServer(ThreadedServer):
+    def listen(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.sock.listen(40)
+        self.sock.setblocking(False)
+        server = await asyncio.start_server(self.listenToClient, sock=self.sock)
+        async with server:
+            await server.serve_forever()
+
+    async def listenToClient(self, clientReader, clientWriter):
+        connectParser = HandshakeParser.ConnectRequestParser()
+        while True:
+            isConnected = False
+            data = await clientReader.read(self.recvSize)
+            if data:
+                isConnected,outHostname,outPort = connectParser.feed(data)
+                if (isConnected):
+                    clientWriter.write(b"HTTP/1.1 200 Connection Established\r\nConnection: close\r\n\r\n")
+                    break
+            else:
+                print("Disconnected before HTTP CONNECT.")
+                clientWriter.close()
+                return False
+
+        # Outgoing socket.
+        try:
+            serverReader, serverWriter = await asyncio.open_connection(outHostname.decode(), int(outPort))
+        except OSError as e:
+            print("WARNING: Could not connect to " + str(outHostname) + ": " + repr(e))
+            clientWriter.close()
+            return False
+
+        loop = asyncio.get_running_loop()
+        connectionID = registerConnection(lambda: loop.call_soon_threadsafe(self.closeWriters, [clientWriter, serverWriter]))
+
+        try:
+            # Is this request targeted to our address?
+            if (HandshakeParser.isTargetedHost(outHostname, self.targetAddr)):
+                self.isBusy = True
+                print("Handling TARGET host: " + str(outHostname))
+                val = await self.handleIUPTISStream(clientReader, clientWriter, serverReader, serverWriter)
+                self.isBusy = False
+                return val
+            else:
+                print("Host: " + str(outHostname))
+                return await self.handleStream(clientReader, clientWriter, serverReader, serverWriter)
+        finally:
+            unregisterConnection(connectionID)
+
+    # Closing the transports ends the reads of the connection, which is then handled as a disconnect.
+    def closeWriters(self, allWriters):
+        for writer in allWriters:
+            writer.close()
+
+    # Forward both directions until one side disconnects.
+    async def handleStream(self, clientReader, clientWriter, serverReader, serverWriter):
+        async def forward(reader, writer):
+            while True:
+                data = await reader.read(self.recvSize)
+                if not data:
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        await self.waitFirst([forward(clientReader, serverWriter), forward(serverReader, clientWriter)])
+        print("Client or server disconnected.")
+        clientWriter.close()
+        serverWriter.close()
+        return True
+
+    async def handleIUPTISStream(self, clientReader, clientWriter, serverReader, serverWriter):
+        iupDel = IUPTISDelay(serverWriter.get_extra_info("sockname"), self.timeWait)
+        loop = asyncio.get_running_loop()
+        timer = None
+
+        # Run the core IUPTISDelay algorithm and pass on the data that it allows.
+        def pump():
+            nonlocal timer
+            while (iupDel.update()):
+                pass
+            if (iupDel.hasDataForClient()):
+                clientWriter.writelines(iupDel.takeBuffersForClient())
+            if (iupDel.hasDataForServer()):
+                serverWriter.writelines(iupDel.takeBuffersForServer())
+
+            # Wake up again when the next TLS record may be passed to the server.
+            if (timer is not None):
+                timer.cancel()
+                timer = None
+            waitingTime = iupDel.getWaitingTime()
+            if (waitingTime is not None):
+                timer = loop.call_later(waitingTime, pump)
+
+        async def receive(reader, handleData, name):
+            while True:
+                data = await reader.read(self.recvSize)
+                if not data:
+                    print("Target " + name + " disconnected.")
+                    return
+                handleData(data)
+                pump()
+                await clientWriter.drain()
+                await serverWriter.drain()
+
+        await self.waitFirst([receive(clientReader, iupDel.sendToServer, "client"), receive(serverReader, iupDel.sendToClient, "server")])
+        if (timer is not None):
+            timer.cancel()
+        iupDel.close()
+        self.isBusy = False
+        clientWriter.close()
+        serverWriter.close()
+        return True
+
+    # Run the coroutines until the first one is finished, then cancel the others.
+    async def waitFirst(self, coroutines):
+        tasks = [asyncio.ensure_future(c) for c in coroutines]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
 class SERVER_STATUS(Enum):
     REQUEST_ON_ROUTE = 1
     SENDING_RESPONSE = 2
@@ -283,18 +505,101 @@ class SERVER_STATUS(Enum):
     WAITING_FOR_REQUEST_FIRST = 4
 
 
+# Buffer of received TCP data with a read cursor. Read data is only removed from the front once it makes up
+# half of the buffer, so extracting a TLS record does not copy the rest of the buffer.
+class StreamBuffer(object):
+    def __init__(self):
+        self.data = bytearray()
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.data) - self.cursor
+
+    def append(self, data):
+        self.data += data
+
+    def startswith(self, prefix):
+        return self.data.startswith(prefix, self.cursor)
+
+    def peek(self, size):
+        return bytes(self.data[self.cursor:self.cursor + size])
+
+    # Length field of the TLS record header at the read cursor.
+    def getTLSLength(self):
+        return struct.unpack_from(">H", self.data, self.cursor + 3)[0]
+
+    def read(self, size):
+        with memoryview(self.data) as view:
+            data = view[self.cursor:self.cursor + size].tobytes()
+        self.cursor += size
+        if (self.cursor * 2 >= len(self.data)):
+            del self.data[:self.cursor]
+            self.cursor = 0
+        return data
+
+
+# Data that may be sent, kept as a queue of separate TLS records instead of one concatenated buffer.
+# The records are sent together with scatter-gather I/O (socket.sendmsg).
+class SendQueue(object):
+    # Maximum number of buffers per sendmsg call (IOV_MAX on Linux).
+    MAX_BUFFERS = 1024
+
+    def __init__(self):
+        self.buffers = collections.deque()
+        self.offset = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data):
+        if (data):
+            self.buffers.append(data)
+            self.size += len(data)
+
+    # Remove and return all buffers.
+    def takeAll(self):
+        buffers = list(self.buffers)
+        if (self.offset > 0):
+            buffers[0] = memoryview(buffers[0])[self.offset:]
+        self.buffers.clear()
+        self.offset = 0
+        self.size = 0
+        return buffers
+
+    # Send as much as the socket accepts, the rest stays queued.
+    def sendTo(self, sock):
+        views = [memoryview(self.buffers[0])[self.offset:]]
+        for i in range(1, min(len(self.buffers), self.MAX_BUFFERS)):
+            views.append(self.buffers[i])
+        sent = sock.sendmsg(views)
+        self.size -= sent
+        remaining = sent
+        while (remaining > 0):
+            firstLen = len(self.buffers[0]) - self.offset
+            if (remaining >= firstLen):
+                remaining -= firstLen
+                self.buffers.popleft()
+                self.offset = 0
+            else:
+                self.offset += remaining
+                remaining = 0
+        return sent
+
+
 class IUPTISDelay:
 
     def __init__(self,sockname,timeWait):
         self.dstip = sockname[0]
         self.srcport = int(sockname[1])
         self.uniqueName = self.dstip + "_" +  str(self.srcport)
-        self.clientData = b""
-        self.serverData = b""
-        self.serverTLSQueue = []
-        self.serverAllowedData = b""
-        self.clientAllowedData = b""
-        self.clientTLSQueue = []
+        self.recordLog = openRecordLog(self.uniqueName)
+        self.clientData = StreamBuffer()
+        self.serverData = StreamBuffer()
+        self.serverTLSQueue = collections.deque()
+        self.serverAllowedData = SendQueue()
+        self.clientAllowedData = SendQueue()
+        self.clientTLSQueue = collections.deque()
         #self.WAIT_COMPLETION = 0.5
         self.WAIT_COMPLETION = timeWait
         self.lastReceivedFromServer = time.time()
@@ -303,6 +608,12 @@ class IUPTISDelay:
         self.serverHasRequest = False
         self.serverStatus = SERVER_STATUS.WAITING_FOR_REQUEST_FIRST
 
+    # The connection is closed, its records are dropped with the next clearRecords().
+    def close(self):
+        self.recordLog.isClosed = True
+        if (liveClassifier is not None):
+            liveClassifier.closeConnection(self.recordLog.name)
+
     def hasDataForClient(self):
         return (len(self.clientAllowedData) > 0)
 
@@ -311,85 +622,79 @@ class IUPTISDelay:
 
     def sendToClient(self,data):
         #print("Received data from server.")
-        self.clientData += data
+        self.clientData.append(data)
 
     def sendToServer(self,data):
         #print("Received data from client.")
-        self.serverData += data
+        self.serverData.append(data)
 
     def getDataForClient(self):
         if (self.hasDataForClient()):
-            backupData = self.clientAllowedData
-            self.clientAllowedData = b""
-            return backupData
+            return b"".join(self.clientAllowedData.takeAll())
 
     def getDataForServer(self):
         if (self.hasDataForServer()):
-            backupData = self.serverAllowedData
-            self.serverAllowedData = b""
-            return backupData
+            return b"".join(self.serverAllowedData.takeAll())
 
-    def update(self):
-        globChanged = False
+    # Same as getDataForClient/getDataForServer, but as a list of buffers without concatenating them.
+    def takeBuffersForClient(self):
+        return self.clientAllowedData.takeAll()
 
-        # Handle data from client to server
-        while (len(self.serverData) > 5):
+    def takeBuffersForServer(self):
+        return self.serverAllowedData.takeAll()
+
+    # Send the allowed data directly to the socket. Data that is not accepted by the socket stays queued.
+    def sendDataToClient(self, sock):
+        return self.clientAllowedData.sendTo(sock)
+
+    def sendDataToServer(self, sock):
+        return self.serverAllowedData.sendTo(sock)
+
+    # Move all complete TLS records from the received data to the queue.
+    def queueTLSRecords(self, data, tlsQueue, destination, source):
+        changed = False
+        while (len(data) > 5):
             #Skip anything else then Application Data Records
-            if (self.serverData[0:3] == b"\x16\x03\x01" or self.serverData[0:3] == b"\x16\x03\x03" or
-                self.serverData[0:3]  == b"\x14\x03\x03" or self.serverData[0:3]  == b"\x15\x03\x03"):
-                tlsLen = struct.unpack(">H", self.serverData[3:5])[0]
-                # Make sure we have enough data to queue the complete TLS Record.
-                if (len(self.serverData) >= tlsLen + 5):
-                    self.serverTLSQueue.append([tlsLen, self.serverData[:tlsLen + 5], False])
-                    self.serverData = self.serverData[tlsLen + 5:]
-                    print("Queuing non-AppData for server.")
-                    globChanged = True
-                else:
-                    break
+            if (data.startswith(b"\x16\x03\x01") or data.startswith(b"\x16\x03\x03") or
+                data.startswith(b"\x14\x03\x03") or data.startswith(b"\x15\x03\x03")):
+                isAppData = False
             # Extract Application Data Records
-            elif (self.serverData[0:3] == b"\x17\x03\x03"):
-                tlsLen = struct.unpack(">H", self.serverData[3:5])[0]
-                # Make sure we have enough data to queue the complete TLS Record.
-                if (len(self.serverData) >= tlsLen + 5):
-                    self.serverTLSQueue.append([tlsLen,self.serverData[:tlsLen+5], True])
-                    self.serverData = self.serverData[tlsLen + 5:]
-                    print("Queuing AppData for server.")
-                    globChanged = True
-                else:
-                    break
+            elif (data.startswith(b"\x17\x03\x03")):
+                isAppData = True
             else:
-                print("Error: Unknown TLS data from client :(. First 3 bytes: " + repr(self.serverData[0:3]))
+                print("Error: Unknown TLS data from " + source + " :(. First 3 bytes: " + repr(data.peek(3)))
                 exit(1)
 
+            tlsLen = data.getTLSLength()
+            # Make sure we have enough data to queue the complete TLS Record.
+            if (len(data) < tlsLen + 5):
+                break
+            tlsQueue.append([tlsLen, data.read(tlsLen + 5), isAppData])
+            if (isAppData):
+                print("Queuing AppData for " + destination + ".")
+            else:
+                print("Queuing non-AppData for " + destination + ".")
+            changed = True
+        return changed
+
+    # Number of seconds until update() may pass the next TLS record to the server, or None if it is not waiting for that.
+    def getWaitingTime(self):
+        if (len(self.serverTLSQueue) == 0 or not self.serverTLSQueue[0][2]):
+            return None
+        if (self.serverStatus != SERVER_STATUS.REQUEST_ON_ROUTE and self.serverStatus != SERVER_STATUS.SENDING_RESPONSE):
+            return None
+        return max(0, self.lastReceivedFromServer + self.WAIT_COMPLETION - time.time())
+
+    def update(self):
+        globChanged = False
+
+        # Handle data from client to server
+        if (self.queueTLSRecords(self.serverData, self.serverTLSQueue, "server", "client")):
+            globChanged = True
 
         # Handle data from server to client.
-        while (len(self.clientData) > 5):
-            # Skip anything else then Application Data Records
-            if (self.clientData[0:3] == b"\x16\x03\x01" or self.clientData[0:3]  == b"\x16\x03\x03" or
-                self.clientData[0:3]  == b"\x14\x03\x03" or self.clientData[0:3]  == b"\x15\x03\x03"):
-                tlsLen = struct.unpack(">H", self.clientData[3:5])[0]
-                # Make sure we have enough data to queue the complete TLS Record.
-                if (len(self.clientData) >= tlsLen + 5):
-                    self.clientTLSQueue.append([tlsLen, self.clientData[:tlsLen + 5], False])
-                    self.clientData = self.clientData[tlsLen + 5:]
-                    print("Queuing non-AppData for client.")
-                    globChanged = True
-                else:
-                    break
-            # Extract Application Data Records
-            elif (self.clientData[0:3] == b"\x17\x03\x03"):
-                tlsLen = struct.unpack(">H", self.clientData[3:5])[0]
-                # Make sure we have enough data to queue the complete TLS Record.
-                if (len(self.clientData) >= tlsLen+5):
-                    self.clientTLSQueue.append([tlsLen,self.clientData[:tlsLen+5], True])
-                    self.clientData = self.clientData[tlsLen + 5:]
-                    print("Queuing AppData for client.")
-                    globChanged = True
-                else:
-                    break
-            else:
-                print("Error: Unknown TLS data from server :(. First 3 bytes: " + repr(self.clientData[0:3]))
-                exit(1)
+        if (self.queueTLSRecords(self.clientData, self.clientTLSQueue, "client", "server")):
+            globChanged = True
 
         hasChanged = True
         while (hasChanged):
@@ -400,9 +705,9 @@ class IUPTISDelay:
                 tlsLen = tlsData[0]
                 tcpData = tlsData[1]
                 isAppData = tlsData[2]
-                self.clientAllowedData += tcpData
+                self.clientAllowedData.append(tcpData)
                 if (isAppData):
-                    addTLSRecord(self.uniqueName, tlsLen, -1, time.time())
+                    self.recordLog.append(tlsLen, -1, time.time())
                 # See small TLS records as non-HTTP response data.
                 if (tlsLen > 160 and isAppData):
                     if (self.serverStatus == SERVER_STATUS.REQUEST_ON_ROUTE):
@@ -424,13 +729,13 @@ class IUPTISDelay:
                 if (self.serverTLSQueue[0][2] == False):
                     tlsData = self.serverTLSQueue[0]
                     tcpData = tlsData[1]
-                    self.serverAllowedData += tcpData
+                    self.serverAllowedData.append(tcpData)
                     del self.serverTLSQueue[0]
                     hasChanged = True
                 elif (self.serverStatus == SERVER_STATUS.WAITING_FOR_REQUEST_FIRST):
                     tlsData = self.serverTLSQueue[0]
                     tcpData = tlsData[1]
-                    self.serverAllowedData = tcpData
+                    self.serverAllowedData.append(tcpData)
                     self.serverStatus = SERVER_STATUS.WAITING_FOR_REQUEST
                     self.lastReceivedFromServer = time.time()   #MAYBE?
                     del self.serverTLSQueue[0]
@@ -438,9 +743,9 @@ class IUPTISDelay:
                 elif (self.serverStatus == SERVER_STATUS.WAITING_FOR_REQUEST):
                     tlsData = self.serverTLSQueue[0]
                     tcpData = tlsData[1]
-                    self.serverAllowedData += tcpData
+                    self.serverAllowedData.append(tcpData)
                     if (tlsData[2]):
-                        addTLSRecord(self.uniqueName, tlsData[0], 1, time.time())
+                        self.recordLog.append(tlsData[0], 1, time.time())
                     self.serverStatus = SERVER_STATUS.REQUEST_ON_ROUTE
                     del self.serverTLSQueue[0]
                     self.lastReceivedFromServer = time.time()
@@ -450,9 +755,9 @@ class IUPTISDelay:
                         # Too long that we got something BIG from the server. Pass another TLS record from client to server.
                         tlsData = self.serverTLSQueue[0]
                         tcpData = tlsData[1]
-                        self.serverAllowedData += tcpData
+                        self.serverAllowedData.append(tcpData)
                         if (tlsData[2]):
-                            addTLSRecord(self.uniqueName, tlsData[0], 1, time.time())
+                            self.recordLog.append(tlsData[0], 1, time.time())
                         if (len(self.serverTLSQueue[0][1]) >= 40):
                             self.lastReceivedFromServer = time.time()
                         #print("Passing another TLS Record from client to server RR.")
@@ -464,8 +769,8 @@ class IUPTISDelay:
                         tlsData = self.serverTLSQueue[0]
                         tcpData = tlsData[1]
                         if (tlsData[2]):
-                            addTLSRecord(self.uniqueName, tlsData[0], 1, time.time())
-                        self.serverAllowedData += tcpData
+                            self.recordLog.append(tlsData[0], 1, time.time())
+                        self.serverAllowedData.append(tcpData)
                         if (len(self.serverTLSQueue[0][1]) >= 40):
                             self.lastReceivedFromServer = time.time()
                         del self.serverTLSQueue[0]
@@ -480,14 +785,29 @@ class IUPTISDelay:
 if __name__ == "__main__":
 
     if (len(sys.argv) < 3):
-        print("usage: python3 tcpproxy.py <time_waiting in seconds> <domain_name>")
+        print("usage: python3 tcpproxy.py <time_waiting in seconds> <domain_name> [threaded|async] [<proxy_port>] [<perform_config>]")
         exit(1)
 
+    serverMode = "threaded"
+    if (len(sys.argv) > 3):
+        serverMode = sys.argv[3]
+    # The communication port is always the next port after the proxy port.
+    proxyPort = 81
+    if (len(sys.argv) > 4):
+        proxyPort = int(sys.argv[4])
+    # With a PERFORM config file, the profile is also identified live.
+    if (len(sys.argv) > 5):
+        import LiveClassifier
+        liveClassifier = LiveClassifier.LiveClassifier(sys.argv[5])
+
     #Running
     print("Running communication thread ... ")
-    threading.Thread(target=communicate).start()
+    threading.Thread(target=communicate,args=(proxyPort + 1, getOutputFileName(proxyPort))).start()
     print("Listening ...")
-    ThreadedServer('', 81,float(sys.argv[1]),sys.argv[2]).listen()
+    if (serverMode == "async"):
+        AsyncServer('', proxyPort,float(sys.argv[1]),sys.argv[2]).listen()
+    else:
+        ThreadedServer('', proxyPort,float(sys.argv[1]),sys.argv[2]).listen()
 
 
 